@@ -0,0 +1,5 @@
+"""
+    @usage: benchmark of the conversion over synthetic C projects
+            python -m benchmark.generate <folder> [knob=value ...]     write a synthetic project
+            python -m benchmark.run [knob=value ...] [--baseline ...]  time the stages over growing sizes
+"""
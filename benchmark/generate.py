@@ -0,0 +1,186 @@
+"""
+    @usage: generate a synthetic C project to benchmark the conversion, e.g. python -m benchmark.generate out_folder headers=16
+    @date: 2026-10-16
+    @python: 3.7
+    @version: 2.1.17
+"""
+import os
+import sys
+import json
+import random
+
+# Knobs of the synthetic project, all the counts except headers are per header file
+DEFAULT_KNOB_DICT = {
+    'seed': 0,
+    'headers': 8,               # number of header files
+    'include_density': 0.3,     # probability that a header includes each of the headers before it
+    'include_cycles': 2,        # number of include loops, each of a header and one after it including each other
+    'macros': 20,               # number of numeric macros
+    'macro_nesting': 4,         # a macro refers to the one before it, up to this depth
+    'if_depth': 3,              # depth of the nested #if clauses around the declarations
+    'typedef_chain': 4,         # length of the chain of typedefs
+    'structs': 6,               # number of structures
+    'struct_fields': 8,         # number of members of each structure
+    'enums': 3,                 # number of enums
+    'enum_size': 10,            # number of values of each enum
+    'functions': 8,             # number of exported functions
+}
+
+basic_types = ['int', 'unsigned int', 'char', 'unsigned char', 'short', 'unsigned short', 'long long', 'float', 'double']
+
+
+class SyntheticProject:
+    """
+    Deterministic generator of a C project. The same knobs always give the same files, so that the time of the
+    conversion can be compared between runs and versions.
+    """
+    def __init__(self, **knobs):
+        unknown_knobs = set(knobs) - set(DEFAULT_KNOB_DICT)
+        if unknown_knobs:
+            raise ValueError(f'Unknown knobs: {", ".join(sorted(unknown_knobs))}')
+        self.knob_dict = dict(DEFAULT_KNOB_DICT, **knobs)
+        self.rng = random.Random(self.knob_dict['seed'])
+        self.include_dict = self.generate_include_dict()    # key = index of header, value = indices of included headers
+
+    def generate_include_dict(self) -> dict:
+        """
+        Each header includes some of the headers before it. For each loop, a header also includes a later header,
+        which includes it back.
+        """
+        headers = self.knob_dict['headers']
+        include_dict = dict()
+        for i in range(headers):
+            include_dict[i] = [j for j in range(i) if self.rng.random() < self.knob_dict['include_density']]
+        for _ in range(self.knob_dict['include_cycles'] if headers > 1 else 0):
+            i, j = sorted(self.rng.sample(range(headers), 2))
+            if i not in include_dict[j]:
+                include_dict[j].append(i)
+            if j not in include_dict[i]:
+                include_dict[i].append(j)
+        return include_dict
+
+    @staticmethod
+    def get_header_name(i: int) -> str:
+        return f'hdr_{i}.h'
+
+    def get_header(self, i: int) -> str:
+        """
+        Source of the i-th header. Only the types of the headers before it are used, so that the structures never
+        contain each other in a loop. The includes of the headers after it, which make the loops, are at the end.
+        """
+        knob_dict = self.knob_dict
+        prefix = f'H{i}'
+        lines = [f'#ifndef {prefix}_H\n', f'#define {prefix}_H\n\n']
+        lines.extend(f'#include "{self.get_header_name(j)}"\n' for j in self.include_dict[i] if j < i)
+        lines.append('\n#ifndef FUNC_PREFIX\n#define FUNC_PREFIX __declspec(dllexport)\n#endif\n\n')
+
+        # Macros, each one refers to the one before it unless it starts a new chain
+        macros = max(knob_dict['macros'], 1)
+        nesting = max(knob_dict['macro_nesting'], 1)
+        for k in range(macros):
+            if k % nesting:
+                lines.append(f'#define {prefix}_M{k} ({prefix}_M{k - 1} + {self.rng.randint(1, 9)})\n')
+            else:
+                lines.append(f'#define {prefix}_M{k} {self.rng.randint(1, 16)}\n')
+        lines.append('\n')
+
+        # Nested #if clauses, the declarations are in the branch that is taken
+        if_depth = knob_dict['if_depth']
+        for d in range(if_depth):
+            if d % 2:
+                lines.append(f'#ifdef {prefix}_M{d % macros}\n')
+            else:
+                lines.append(f'#if {prefix}_M{d % macros} > 0 && defined({prefix}_H)\n')
+        lines.append('\n')
+
+        # Chain of typedefs ending with a basic type
+        chain = max(knob_dict['typedef_chain'], 1)
+        lines.append(f'typedef {self.rng.choice(basic_types)} {prefix}_T0;\n')
+        for k in range(1, chain):
+            lines.append(f'typedef {prefix}_T{k - 1} {prefix}_T{k};\n')
+        lines.append('\n')
+
+        for k in range(knob_dict['enums']):
+            values = [f'    {prefix}_E{k}_V0 = {prefix}_M{k % macros}']
+            values.extend(f'    {prefix}_E{k}_V{v}' for v in range(1, knob_dict['enum_size']))
+            lines.append('typedef enum {\n' + ',\n'.join(values) + f'\n}} {prefix}_E{k};\n\n')
+
+        # Members of the structures: basic types, typedefs, enums, arrays, pointers and the structures declared before
+        field_types = [f'{prefix}_T{chain - 1}', f'{prefix}_T0*']
+        field_types.extend(f'{prefix}_E{k}' for k in range(knob_dict['enums']))
+        field_types.extend(f'H{j}_S0' for j in self.include_dict[i] if j < i and knob_dict['structs'])
+        for k in range(knob_dict['structs']):
+            fields = list()
+            for f in range(knob_dict['struct_fields']):
+                choice = self.rng.randrange(4)
+                if choice == 0:
+                    fields.append(f'    {self.rng.choice(basic_types)} f{f};')
+                elif choice == 1:
+                    fields.append(f'    {self.rng.choice(basic_types)} f{f}[{prefix}_M{self.rng.randrange(macros)}];')
+                else:
+                    fields.append(f'    {self.rng.choice(field_types)} f{f};')
+            lines.append(f'typedef struct _{prefix}_S{k} {{\n' + '\n'.join(fields) + f'\n}} {prefix}_S{k};\n\n')
+            field_types.append(f'{prefix}_S{k}')
+
+        for k in range(knob_dict['functions']):
+            params = [f'{self.rng.choice(field_types)} a0', 'int a1', 'unsigned char* a2']
+            params = params[:self.rng.randint(1, len(params))]
+            lines.append(f'FUNC_PREFIX {prefix}_T{chain - 1} h{i}_func{k}({", ".join(params)});\n')
+
+        for d in reversed(range(if_depth)):
+            lines.append(f'#else\n#define {prefix}_SKIPPED_{d} 1\n#endif\n')
+        lines.append('\n')
+        lines.extend(f'#include "{self.get_header_name(j)}"\n' for j in self.include_dict[i] if j > i)
+        lines.append(f'\n#endif /* {prefix}_H */\n')
+        return ''.join(lines)
+
+    def write(self, folder: str) -> list:
+        """
+        Write the headers into the folder, return their paths
+        """
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        file_paths = list()
+        for i in range(self.knob_dict['headers']):
+            file_path = os.path.join(folder, self.get_header_name(i))
+            with open(file_path, 'w') as fp:
+                fp.write(self.get_header(i))
+            file_paths.append(file_path)
+        return file_paths
+
+
+def write_config(work_dir: str, project_folder: str, profile=True):
+    """
+    Write the config.json to convert the project in work_dir. The cache is disabled, so every stage is run in full.
+    """
+    config = {
+        'header_files': [],
+        'project_folders': [project_folder],
+        'exception_dict': {},
+        'predefined_macro_dict': {'NULL': '0'},
+        'use_cache': False,
+        'profile': profile,
+    }
+    with open(os.path.join(work_dir, 'config.json'), 'w') as fp:
+        json.dump(config, fp, indent=4)
+
+
+def parse_knobs(args: list) -> dict:
+    """
+    Knobs from the command line in the form of name=value
+    """
+    knob_dict = dict()
+    for arg in args:
+        name, _, value = arg.partition('=')
+        if name not in DEFAULT_KNOB_DICT:
+            raise ValueError(f'Unknown knob: {name}')
+        knob_dict[name] = type(DEFAULT_KNOB_DICT[name])(value)
+    return knob_dict
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f'Usage: python -m benchmark.generate <folder> [{"=... ".join(DEFAULT_KNOB_DICT)}=...]')
+        sys.exit(1)
+    project = SyntheticProject(**parse_knobs(sys.argv[2:]))
+    print(f'{len(project.write(sys.argv[1]))} header(s) written into {sys.argv[1]}')
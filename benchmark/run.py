@@ -0,0 +1,160 @@
+"""
+    @usage: time the stages of conversion over synthetic projects of growing size, e.g.
+            python -m benchmark.run --knob headers --sizes 1,2,4,8 --baseline benchmark/baseline.json
+    @date: 2026-10-16
+    @python: 3.7
+    @version: 2.1.17
+"""
+import os
+import sys
+import math
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+from benchmark.generate import DEFAULT_KNOB_DICT, SyntheticProject, write_config, parse_knobs
+
+parse_py_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'parse.py')
+
+
+def run_parser(work_dir: str) -> dict:
+    """
+    Convert the project in work_dir with parse.py in a new process, return its profile.json
+    """
+    subprocess.run([sys.executable, parse_py_path, '--profile'], cwd=work_dir, check=True,
+                   stdout=subprocess.DEVNULL)
+    with open(os.path.join(work_dir, 'profile.json'), 'r') as fp:
+        return json.load(fp)
+
+
+def get_scaling_exponent(sizes: list, seconds: list) -> float:
+    """
+    Slope of log(seconds) over log(size) by least squares, about 1 for linear and 2 for quadratic growth
+    """
+    points = [(math.log(size), math.log(max(s, 1e-6))) for size, s in zip(sizes, seconds)]
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def run_benchmark(knob: str, sizes: list, repeat=3, knob_dict=None, work_dir=None) -> dict:
+    """
+    Convert a synthetic project for each size, where the knob is multiplied by the size.
+    The fastest of the repeated runs is kept for each stage, it is the least disturbed by other processes.
+    """
+    base_knob_dict = dict(DEFAULT_KNOB_DICT, **(knob_dict or dict()))
+    base_value = base_knob_dict[knob]
+    stage_dict = dict()     # key = name of stage, value = seconds of each size
+    counter_list = list()   # counters of each size
+    temp_dir = work_dir or tempfile.mkdtemp(prefix='c2py_benchmark_')
+    try:
+        for size in sizes:
+            knob_dict = dict(base_knob_dict, **{knob: type(base_value)(base_value * size)})
+            size_dir = os.path.join(temp_dir, f'{knob}_{size}')
+            SyntheticProject(**knob_dict).write(os.path.join(size_dir, 'prj'))
+            write_config(size_dir, 'prj')
+            best_dict = dict()
+            for _ in range(repeat):
+                profile = run_parser(size_dir)
+                seconds_dict = {stage['name']: stage['seconds'] for stage in profile['stages']}
+                seconds_dict['total'] = profile['seconds']
+                for name, seconds in seconds_dict.items():
+                    best_dict[name] = min(best_dict.get(name, seconds), seconds)
+            for name, seconds in best_dict.items():
+                stage_dict.setdefault(name, list()).append(seconds)
+            counter_list.append(profile['counters'])
+            print(f'{knob}={knob_dict[knob]}: {best_dict["total"]:.3f}s')
+    finally:
+        if work_dir is None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        'python': sys.version.split()[0],
+        'knob': knob,
+        'sizes': sizes,
+        'knob_dict': base_knob_dict,
+        'counters': counter_list,
+        'stages': {name: {'seconds': seconds, 'exponent': round(get_scaling_exponent(sizes, seconds), 3)}
+                   for name, seconds in stage_dict.items() if len(seconds) == len(sizes)},
+    }
+
+
+def print_report(result: dict):
+    """
+    Print the seconds of each stage over the sizes and the exponent of its scaling curve
+    """
+    sizes = result['sizes']
+    name_width = max(len(name) for name in result['stages'])
+    print(f'\n{"stage":<{name_width}}' + ''.join(f'{"x" + str(size):>10}' for size in sizes) + f'{"exponent":>10}')
+    for name, stage in result['stages'].items():
+        print(f'{name:<{name_width}}' + ''.join(f'{s:>10.4f}' for s in stage['seconds']) + f'{stage["exponent"]:>10.2f}')
+
+
+def compare_with_baseline(result: dict, baseline: dict, tolerance: float, min_seconds: float) -> list:
+    """
+    Return the stages which scale worse than the baseline and superlinearly, each by more than the tolerance.
+    The stages faster than min_seconds at the largest size are skipped, their times are mostly noise.
+    Raise ValueError if the baseline is scaled over another knob, other sizes or other values of knobs, whose
+    exponents are not comparable.
+    """
+    for key in ('knob', 'sizes'):
+        if baseline.get(key) != result[key]:
+            raise ValueError(f'{key} of the baseline is {baseline.get(key)}, not {result[key]}')
+    baseline_knob_dict = baseline.get('knob_dict', dict())
+    different_knobs = [f'{name}={baseline_knob_dict.get(name)}' for name, value in result['knob_dict'].items()
+                       if baseline_knob_dict.get(name) != value]
+    if different_knobs:
+        raise ValueError(f'knobs of the baseline are {", ".join(different_knobs)}')
+    regressions = list()
+    for name, stage in result['stages'].items():
+        if name not in baseline['stages'] or stage['seconds'][-1] < min_seconds:
+            continue
+        baseline_exponent = baseline['stages'][name]['exponent']
+        if stage['exponent'] > max(baseline_exponent, 1.0) + tolerance:
+            regressions.append(f'{name}: exponent {stage["exponent"]:.2f}, baseline {baseline_exponent:.2f}')
+    return regressions
+
+
+def main(args=None) -> int:
+    arg_parser = argparse.ArgumentParser(description='Benchmark the conversion over synthetic projects.')
+    arg_parser.add_argument('knobs', nargs='*', help='knobs of the project in the form of name=value, see '
+                                                     'benchmark/generate.py')
+    arg_parser.add_argument('--knob', default='headers', choices=sorted(DEFAULT_KNOB_DICT), help='knob to scale')
+    arg_parser.add_argument('--sizes', default='1,2,4,8', help='factors of the knob, separated by comma')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='runs of each size, the fastest is kept')
+    arg_parser.add_argument('--output', help='write the result into this json file')
+    arg_parser.add_argument('--baseline', help='fail if a stage scales worse than in this result json')
+    arg_parser.add_argument('--tolerance', type=float, default=0.25, help='allowed increase of scaling exponent')
+    arg_parser.add_argument('--min-seconds', type=float, default=0.01, help='skip the faster stages in comparison')
+    arg_parser.add_argument('--work-dir', help='keep the generated projects and outputs in this folder')
+    args = arg_parser.parse_args(args)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if len(sizes) < 2 or min(sizes) < 1:
+        arg_parser.error('at least two positive sizes are needed for a scaling curve')
+    result = run_benchmark(args.knob, sizes, args.repeat, parse_knobs(args.knobs), args.work_dir)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(result, fp, indent=4)
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        try:
+            regressions = compare_with_baseline(result, baseline, args.tolerance, args.min_seconds)
+        except ValueError as e:
+            print(f'\nUnable to compare with the baseline: {e}')
+            return 1
+        if regressions:
+            print('\nSuperlinear regressions:\n' + '\n'.join(regressions))
+            return 1
+        print('\nNo regression against the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
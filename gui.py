@@ -13,6 +13,7 @@ import PySimpleGUI as sg
 import json
 from parse import Parser
 import xml.dom.minidom
+import multiprocessing
 
 
 def parse_xml(xml_name: str, yes_no: str):
@@ -121,6 +122,7 @@ def dict_to_list(macro_dict: dict):
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()     # gui.exe may start processes to convert, see "workers" in config
     config = dict()
     if os.path.exists('config.json'):
         with open('config.json', 'r') as fp:    # load previous configuration
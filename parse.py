@@ -12,45 +12,206 @@ import glob
 import os
 import re
 import logging
-import traceback
 import json
-from collections import deque
+import operator
+import heapq
+import collections
+import io
+import contextlib
+import py_compile
+import keyword
+import functools
+import itertools
+import hashlib
+import ctypes
+import runpy
+import time
+import tracemalloc
+import array
+from concurrent.futures import ProcessPoolExecutor
 import sys
 
 
-def rm_miscellenous(lines: str) -> str:
+# Tokens rm_miscellenous() has to look at: comments, line continuations, string/char literals (kept verbatim so that
+# comment markers inside them survive), runs of blank lines, "[" and the ornamental keywords such as auto, volatile,
+# static etc. Every alternative starts with a literal character, which lets the re module skip plain code quickly.
+redundant_keyword_list = ['const', 'signed', 'auto', 'volatile', 'static', 'inline', '__iomem']
+c_trivia_pattern = re.compile(r'''/(?:/[^\n]*|\*.*?\*/)|\\\n|"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|\n\n\n+|\['''
+                              + ''.join(r'|{0}(?<!\w{0}){1}\b'.format(key[0], key[1:]) for key in redundant_keyword_list),
+                              re.S)
+comment_start_pattern = re.compile(r'''"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|/[*/]''')     # literals are skipped
+include_pattern = re.compile(r'#include\s+["<](\w+.h)[">]\s*')
+sizeof_pattern = re.compile(r'sizeof\(([\w\s*]+)\)')
+c_identifier_pattern = re.compile(r'\w+')
+c_define_or_identifier_pattern = re.compile(r'(#define\s+.*\n)|\w+')
+conditional_directive_pattern = re.compile(r'^[ \t]*#[ \t]*(ifdef|ifndef|if|elif|else|endif)\b(.*)\n?', re.M)
+array_head_pattern = re.compile(r'(\w+(?:[ \t]+\w+)*)\s+(\w+)\s*((?:\[[^\]\n]*]\s*)+)=(?!=)')     # match: int a[2][3] =
+initializer_token_pattern = re.compile(r'[{}]|[^{}]+')
+
+# Declarations in each header file, found once and cached with the file, see PreProcessor.find_declarations().
+# The typedefs and enums are found in the code kept by check_macro(), the others once the macros are replaced.
+declaration_pattern_dict = {
+    'typedefs': re.compile(r'typedef\s+([\w\s*]+)\s+([*\w]+);'),
+    'typedef_enums': re.compile(r'typedef enum[^;]+;'),                                     # match: typedef enum {} a;
+    'enums': re.compile(r'enum\s+(\w+)\s*{([^{}]+)};'),                                     # match: enum a {};
+}
+replaced_declaration_pattern_dict = {
+    'func_ptrs': re.compile(r'typedef\s+(\w+)\s*\(\*\s*([\w]+)\s*\)\s*\((.*?)\)\s*;', re.S),
+    'typedef_structs': re.compile(r'typedef struct([\s\w]*){([^{}]+)}([\s\w,*]+);\s'),       # match: typedef struct _a{}a, *ap;
+    'typedef_unions': re.compile(r'typedef union([\s\w]*){([^{}]+)}([\s\w,*]+);\s'),         # match: typedef union _a{}a, *ap;
+    'structs': re.compile(r'struct\s*([\w]+)\s*{([^}]+)?}\s*;'),                            # match: struct _a{};
+    'unions': re.compile(r'union\s*([\w]+)\s*{([^}]+)?}\s*;'),                              # match: union _a{};
+    'funcs': re.compile(r'__declspec\(dllexport\)\s+([*\w]+)\s+(\w+)\s*\((.*?)\)\s*;', re.S),  # exported functions
+}
+brace_to_bracket_table = str.maketrans('{}', '[]')
+c_expr_token_pattern = re.compile(r'''(?P<space>\s+)|(?P<num>(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?[fFlL]?|\d+[eE][+-]?\d+[fFlL]?'''
+                                  r'''|0[xX][\da-fA-F]+[uUlL]*|0[bB][01]+[uUlL]*|\d+[uUlL]*)'''
+                                  r'''|(?P<char>'(?:[^'\\]|\\.[^']*)')|(?P<name>[A-Za-z_]\w*)'''
+                                  r'''|(?P<op><<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^~!<>?:(),])''')
+
+
+parse_cache_version = 3        # bump it when the cached results of a stage change format or meaning
+host_abi = 'llp64' if sys.platform == 'win32' else 'lp64'       # ABI of the running python, which ctypes follows
+
+
+class CExprError(ValueError):
     """
-    remove C comments in the file to parse
+    Raised when a C constant expression cannot be evaluated
     """
-    m = re.compile(r'//.*')
-    lines = re.sub(m, '', lines)
-    m = re.compile(r'/\*.*?\*/', re.S)
-    lines = re.sub(m, '', lines)
+    pass
+
 
+def rm_miscellenous(lines: str) -> str:
     """
-    remove backslash at the end of each line
+    Clean the C code in one scan:
+    remove C comments and the backslash at the end of each line;
+    remove additional new lines to make debugging info clear;
+    remove ornamental keywords such as auto, volatile, static etc.;
+    remove space before bracket, which will save the work to match arrays.
+    Only the cleaned text is returned, no map of offsets back to the source is kept, since no later stage reports
+    positions in the source files.
     """
-    lines = re.sub(r'\\\n', '', lines)
+    pieces = list()
+    new_lines = 0                   # number of new lines at the end of the cleaned code
+
+    def append_code(code: str):
+        nonlocal new_lines
+        if code[0] == '\n':         # keep at most 2 new lines in a row, including those left by removed comments
+            leading = len(code) - len(code.lstrip('\n'))
+            if new_lines + leading > 2:
+                code = code[leading - max(0, 2 - new_lines):]
+                if not code:
+                    return
+        if code[-1] != '\n':
+            new_lines = 0
+        elif code.strip('\n'):
+            new_lines = len(code) - len(code.rstrip('\n'))
+        else:
+            new_lines += len(code)
+        pieces.append(code)
+
+    pos = 0
+    for m in c_trivia_pattern.finditer(lines):
+        token = m.group()
+        if m.start() > pos:
+            append_code(lines[pos:m.start()])
+        pos = m.end()
+
+        if token[0] == '\n':
+            append_code(token)
+        elif token[0] == '"' or token[0] == "'":
+            pieces.append(token)
+            new_lines = 0
+        elif token == '[':
+            while pieces and pieces[-1][-1].isspace():
+                code = pieces.pop().rstrip()
+                if code:
+                    pieces.append(code)
+                    break
+            pieces.append(token)
+            new_lines = 0
+    if pos < len(lines):
+        append_code(lines[pos:])
+
+    return ''.join(pieces)
 
+
+def is_comment_open(text: str, in_comment=False) -> bool:
     """
-    remove additional new lines to make debugging info clear
+    Return whether a block comment is still open at the end of a line, in_comment is whether it is open at the start
     """
-    lines = re.sub(r'\n{3,}', '\n\n', lines)
-
+    pos = 0
+    while True:
+        if in_comment:
+            end = text.find('*/', pos)
+            if end < 0:
+                return True
+            pos = end + 2
+        m = comment_start_pattern.search(text, pos)
+        if m is None or m.group() == '//':
+            return False
+        in_comment = m.group() == '/*'
+        pos = m.end()
+
+
+def replace_sizeof_basic_type(lines: str, sizeof_basic_type_dict: dict) -> str:
     """
-    remove ornamental keywords such as auto, volatile, static etc.
+    Replace sizeof(basic type) with its value, see PreProcessor.get_sizeof_basic_type_dict().
+    sizeof(structure) and others are kept.
     """
-    redundant_keyword_list = ['const', 'signed', 'auto', 'volatile', 'static', 'inline', '__iomem']
+    def replace(m) -> str:
+        content = m.group(1)
+        if content != content.strip():
+            return m.group()
+        elif '*' in content:                            # is a pointer
+            return sizeof_basic_type_dict['*']
+        return sizeof_basic_type_dict.get(content, m.group())
+
+    return sizeof_pattern.sub(replace, lines)
 
-    for key in redundant_keyword_list:
-        lines = re.sub(r'\b{}\b'.format(key), '', lines)
 
+def write_output_file(file_path: str, content, compile_py=True) -> bool:
     """
-    remove space before bracket, which will save the work to match arrays
+    Write the whole content into a temporary file in the same folder, then rename it to file_path. The rename is
+    atomic, so other processes never see a partially written file.
+    The file is left untouched if its content is not changed, which keeps its mtime and the bytecode compiled from it
+    valid. A changed python module is compiled at once, so that the processes importing it do not have to.
+    content is either str or bytes. Return True if the file is written.
     """
-    lines = re.sub(r'\s+\[', '[', lines)
-
-    return lines
+    mode = 'b' if isinstance(content, bytes) else ''
+    try:
+        with open(file_path, 'r' + mode) as fp:
+            if fp.read() == content:
+                return False
+    except (OSError, ValueError):
+        pass                                    # not existing or unreadable, write it anyway
+
+    tmp_path = f'{file_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'w' + mode) as fp:
+            fp.write(content)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if compile_py and file_path.endswith('.py'):
+        try:
+            py_compile.compile(file_path, doraise=True)
+        except py_compile.PyCompileError as e:
+            logging.error(f'Error in compiling {file_path}: {e.msg}')
+    return True
+
+
+@contextlib.contextmanager
+def open_output_file(file_path: str, compile_py=True):
+    """
+    Render an output file in memory, it is written by write_output_file() once the rendering succeeds
+    """
+    with io.StringIO() as fp:
+        yield fp
+        write_output_file(file_path, fp.getvalue(), compile_py)
 
 
 def unique_list(file_list: list) -> list:
@@ -82,6 +243,10 @@ class CommonParser:
         self.func_name_list = list()                    # names of functions in wrapper
         self.struct_union_type_dict = dict()
         self.basic_type_dict = dict()
+        self.symbol_dict = dict()                       # key = type name, value = _Symbol, see add_symbol()
+        self.counter_dict = dict()                      # key = name of counter, value = integer, see count()
+        self.stage_list = list()                        # (name, seconds, peak memory) of stages, see stage()
+        self.stage_stack = list()                       # [name, peak memory of finished inner stages] of open stages
         self.sizeof_basic_c_type_dict_32bit = dict()
         self.sizeof_basic_c_type_dict_64bit = dict()
 
@@ -90,8 +255,14 @@ class CommonParser:
             self.env = json.load(fp)
         self.exception_dict = self.env.get('exception_dict', dict())
         self.func_pointer_dict = self.env.get('func_pointer_dict', dict())   # key: str, item: list of parameters
-        self.macro_dict = self.env.get('predefined_macro_dict', dict())
+        self.func_pointer_header_dict = dict()          # key = name of function pointer, value = header file without ".h"
+        self.macro_dict = self._MacroDict(self.env.get('predefined_macro_dict', dict()))
         self.dll_path = self.env.get('dll_path', 'Sample.dll')
+        self.is_profiling = self.env.get('profile', False)
+        for name, ctypes_name in self.exception_dict.items():
+            self.add_symbol(name, 'exception', ctypes_name)
+        for name in self.func_pointer_dict:
+            self.add_symbol(name, 'func_ptr')
 
         # Basic C types, preload here
         self.basic_c_type_keys = ['int', 'int8_t', 'int16_t', 'int32_t', 'int64_t', 'uint8_t', 'uint16_t', 'uint32_t', 'uint64_t',
@@ -100,17 +271,32 @@ class CommonParser:
         self.basic_ctypes_lib_vars = ['c_int', 'c_int8', 'c_int16', 'c_int32', 'c_int64', 'c_uint8', 'c_uint16', 'c_uint32', 'c_uint64',
                            'c_longlong', 'c_long', 'c_wchar', 'c_ulonglong', 'c_ulong', 'c_short', 'c_ushort', 'c_longdouble',
                            'c_uint', 'c_float', 'c_double', 'c_char', 'c_ubyte', 'c_bool', 'c_size_t', 'c_ssize_t', 'c_size_t']
+        # Sizes of gcc/clang on Linux and macOS (ILP32 and LP64), see abi_sizeof_dict for the other ABIs
         self.sizeof_basic_c_type_32bit = [4, 1, 2, 4, 8, 1, 2, 4, 8,
-                                       8, 4, 1, 8, 4, 2, 2, 12,
-                                       4, 4, 8, 1, 1, 4, 1, 4, 4]
-
-        self.sizeof_basic_c_type_64bit = [8, 1, 2, 4, 8, 1, 2, 4, 8,
-                                        8, 8, 1, 8, 8, 2, 2, 16,
-                                       8, 4, 8, 1, 1, 1, 8, 8]
-
+                                       8, 4, 4, 8, 4, 2, 2, 12,
+                                       4, 4, 8, 1, 1, 1, 4, 4, 4]
+
+        self.sizeof_basic_c_type_64bit = [4, 1, 2, 4, 8, 1, 2, 4, 8,
+                                        8, 8, 4, 8, 8, 2, 2, 16,
+                                       4, 4, 8, 1, 1, 1, 8, 8, 8]
+
+        # Sizes which differ on MSVC (LLP64 on 64 bit), whose long is 4 bytes, wchar_t 2 bytes and long double 8 bytes
+        self.abi_sizeof_dict = {
+            'lp64': dict(),
+            'llp64': {'c_long': 4, 'c_ulong': 4, 'c_wchar': 2, 'c_longdouble': 8},
+        }
+        self.target_abi = self.env.get('target_abi', host_abi)
+        if self.target_abi not in self.abi_sizeof_dict:
+            logging.error(f'Unknown target_abi {self.target_abi}, {host_abi} is used instead')
+            self.target_abi = host_abi
+
+        self.unsigned_ctypes_lib_vars = ['c_uint8', 'c_uint16', 'c_uint32', 'c_uint64', 'c_ulonglong', 'c_wchar', 'c_ulong',
+                                         'c_ushort', 'c_uint', 'c_ubyte', 'c_bool', 'c_size_t']
+
+        abi_sizeof_dict = self.abi_sizeof_dict[self.target_abi]
         for key, sizeof_key_32, sizeof_key_64 in zip(self.basic_ctypes_lib_vars, self.sizeof_basic_c_type_32bit, self.sizeof_basic_c_type_64bit):
-            self.sizeof_basic_c_type_dict_32bit[key] = str(sizeof_key_32)
-            self.sizeof_basic_c_type_dict_64bit[key] = str(sizeof_key_64)
+            self.sizeof_basic_c_type_dict_32bit[key] = str(abi_sizeof_dict.get(key, sizeof_key_32))
+            self.sizeof_basic_c_type_dict_64bit[key] = str(abi_sizeof_dict.get(key, sizeof_key_64))
 
     class _Param:
         """
@@ -128,6 +314,52 @@ class CommonParser:
             self.arg_type = arg_info[0].strip()
             self.arg_name = arg_info[1]
 
+    class _MacroDict(dict):
+        """
+        Dictionary of macros. The version is bumped whenever a macro is added, changed or removed, so that results derived
+        from the macros can be cached until the next change. The names of those macros are logged in changed_names, so
+        that only the results derived from them have to be dropped.
+        """
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.version = 0
+            self.changed_names = list()
+
+        def touch(self, *names):
+            self.changed_names.extend(names)
+            self.version += 1
+
+        def __setitem__(self, key, value):
+            super().__setitem__(key, value)
+            self.touch(key)
+
+        def __delitem__(self, key):
+            super().__delitem__(key)
+            self.touch(key)
+
+        def update(self, *args, **kwargs):
+            other = dict(*args, **kwargs)
+            super().update(other)
+            self.touch(*other)
+
+        def setdefault(self, key, default=None):
+            self.touch(key)
+            return super().setdefault(key, default)
+
+        def pop(self, key, *args):
+            self.touch(key)
+            return super().pop(key, *args)
+
+        def popitem(self):
+            item = super().popitem()
+            self.touch(item[0])
+            return item
+
+        def clear(self):
+            names = list(self)
+            super().clear()
+            self.touch(*names)
+
     class _Type:
         """
         Class used in TypeDefParser
@@ -138,39 +370,88 @@ class CommonParser:
             self.base_type = base_type
             self.is_ptr = is_ptr
 
+    class _Symbol:
+        """
+        An entry of the symbol table, recording the kind of a type name and its resolved ctypes name
+        """
+        def __init__(self, kind: str, ctypes_name: str, is_ptr: bool):
+            self.kind = kind                # one of CommonParser.symbol_kind_priority
+            self.ctypes_name = ctypes_name
+            self.is_ptr = is_ptr
+
+    # A name defined as several kinds resolves to the kind listed first
+    symbol_kind_priority = {'exception': 0, 'basic': 1, 'enum': 2, 'struct': 3, 'struct_typedef': 4, 'func_ptr': 5}
+
+    def add_symbol(self, name: str, kind: str, ctypes_name=None, is_ptr=False):
+        """
+        Add a type name into the symbol table. ctypes_name is the fully resolved ctypes name, default to the name itself.
+        """
+        symbol = self.symbol_dict.get(name)
+        if symbol is None or self.symbol_kind_priority[kind] <= self.symbol_kind_priority[symbol.kind]:
+            self.symbol_dict[name] = self._Symbol(kind, name if ctypes_name is None else ctypes_name, is_ptr)
+
+    def get_symbol_kind(self, name: str):
+        symbol = self.symbol_dict.get(name)
+        return symbol.kind if symbol else None
+
     class _DebugInfo:
         def __init__(self):
             self.filename = ''
             self.line_number = 0
 
+    def count(self, name: str, value=1):
+        """
+        Add value to a counter of the profile, see Parser.write_profile()
+        """
+        self.counter_dict[name] = self.counter_dict.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Record the wall time and the peak of memory allocated by python in a stage of conversion when profiling.
+        The name of a stage inside another one is prefixed by the outer name, e.g. parse/check_macro.
+        """
+        if not self.is_profiling:
+            yield
+            return
+        if self.stage_stack:
+            name = f'{self.stage_stack[-1][0]}/{name}'
+        self.stage_stack.append([name, 0])
+        if hasattr(tracemalloc, 'reset_peak'):      # python 3.9+, otherwise the peak is since profiling starts
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            _, inner_peak = self.stage_stack.pop()
+            peak = max(tracemalloc.get_traced_memory()[1], inner_peak)
+            if self.stage_stack:
+                self.stage_stack[-1][1] = max(self.stage_stack[-1][1], peak)
+            self.stage_list.append((name, seconds, peak))
+
     def convert_to_ctypes(self, arg_type: str, arg_ptr_flag: bool, debug_info=None):
         """
         Convert customized variable type to ctypes according to the type dict
         """
-        if self.exception_dict.__contains__(arg_type):
-            arg_type = self.exception_dict[arg_type]
-            arg_ptr_flag = False
-        elif self.basic_type_dict.__contains__(arg_type):
-            arg_ptr_flag = self.basic_type_dict[arg_type].is_ptr or arg_ptr_flag
-            arg_type = self.basic_type_dict[arg_type].base_type
-            if arg_type == 'None' and arg_ptr_flag:
-                arg_type = 'c_void_p'
-                arg_ptr_flag = False
-        elif arg_type in self.enum_class_name_list:
-            pass
-        elif arg_type in self.struct_class_name_list:
-            pass
-        elif self.struct_union_type_dict.__contains__(arg_type):
-            arg_ptr_flag = self.struct_union_type_dict[arg_type].is_ptr or arg_ptr_flag
-            arg_type = self.struct_union_type_dict[arg_type].base_type
-        elif self.func_pointer_dict.__contains__(arg_type):
-            arg_type = f"CFUNCTYPE({', '.join(self.func_pointer_dict[arg_type])})"
-            arg_ptr_flag = True
-        else:
+        symbol = self.symbol_dict.get(arg_type)
+        if symbol is None:
             if self.struct_class_name_list:         # if structure and union were parsed
                 logging.warning(f'Unrecognized type! Type name: {arg_type}.')
+                self.count('unresolved_types')
             # if debug_info:
             #     logging.warning(f'File: {debug_info.filename}, Line: {debug_info.line_number}')
+        elif symbol.kind == 'exception':
+            arg_type = symbol.ctypes_name
+            arg_ptr_flag = False
+        elif symbol.kind == 'func_ptr':
+            arg_ptr_flag = True                     # the type is defined once as CFUNCTYPE, see get_func_ptr_type()
+        else:
+            arg_ptr_flag = symbol.is_ptr or arg_ptr_flag
+            arg_type = symbol.ctypes_name
+            if arg_type == 'None' and arg_ptr_flag:
+                arg_type = 'c_void_p'
+                arg_ptr_flag = False
 
         return arg_type, arg_ptr_flag
 
@@ -182,41 +463,56 @@ class PreProcessor(CommonParser):
     def __init__(self):
         super().__init__()
         self.intermediate_h_files = list()  # list of intermediate h files
+        self.declaration_list = list()      # declarations found in each intermediate h file, see find_declarations()
+        self.check_macro_key_list = list()  # key of each intermediate h file in the cache of check_macro()
         self.macro_func_dict = dict()   # key = name of macro func, value = macro func class
-
-        # C operator dictionary in #if clause
-        self.c_operator_dict = {'&&': ' and ', '||': ' or ', 'defined': ''}
-
-        self.fully_visited_list = list()
-        self.visited_list = list()
-        self.node_list = self._NodeList()
-        self.detected_loop = False
-        self.squeezed_flag = False
+        self.macro_expansion_dict = dict()      # key = name of macro, value = fully substituted text of macro
+        self.macro_expansion_version = None     # version of macro_dict when macro_expansion_dict was generated
+
+        # C operator dictionary in constant expressions
+        self.c_compare_op_dict = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+                                  '>': operator.gt, '>=': operator.ge}
+        self.c_arithmetic_op_dict = {'+': operator.add, '-': operator.sub, '*': operator.mul,
+                                     '&': operator.and_, '|': operator.or_, '^': operator.xor}
+        self.c_macro_value_dict = dict()        # key = (name of macro, is_if_clause), value = (value, c_type)
+        self.if_clause_dict = dict()            # key = expression of #if clause, value = bool
+        self.c_macro_user_dict = dict()         # key = name of macro, value = set of the keys of the two dicts above
+                                                # whose values use the macro directly
+        self.c_macro_name_stack = list()        # sets of the macros used by the expressions being evaluated
+        self.c_macro_change_count = 0           # number of macro_dict.changed_names already forgotten
+
+        self.include_graph = dict()     # key = header file, value = dict of header files included after it
+        self.source_dict = dict()       # key = source file, value = _Source read and cleaned once in this run
+        self.cache_dict = None          # results of the last run loaded from cache file, None if cache is disabled
+        self.new_cache_dict = None      # results of this run, which will be saved into cache file
+        self.executor = None            # pool of processes when "workers" > 1 in config
 
         if sys.maxsize > 2 ** 32:
             self.PLATFORM_BIT_SCALER = 2    # 64 bit
         else:
             self.PLATFORM_BIT_SCALER = 1    # 32 bit
 
-    def parse_sizeof_basic_type(self, lines: str) -> str:
-        contents = re.findall(r'sizeof\(([\w\s*]+)\)', lines)
-        for content in contents:
-            content = content.strip()
-            if '*' in content or content in self.enum_class_name_list:  # is a pointer
-                lines = lines.replace(f'sizeof({content})', f'{4 * self.PLATFORM_BIT_SCALER}')
-            elif self.basic_type_dict.__contains__(content):
-                if self.basic_type_dict[content].is_ptr:    # is a pointer
-                    lines = lines.replace(f'sizeof({content})', f'{4 * self.PLATFORM_BIT_SCALER}')
-                else:
-                    arg_type = self.basic_type_dict[content].base_type
-                    if self.PLATFORM_BIT_SCALER == 1:   # 32bit
-                        lines = re.sub(f'sizeof\({content}\)', self.sizeof_basic_c_type_dict_32bit[arg_type], lines)
-                    else:   # 64 bit
-                        lines = re.sub(f'sizeof\({content}\)', self.sizeof_basic_c_type_dict_64bit[arg_type], lines)
-            else:
-                pass            # for structure and others, to do
+    def get_sizeof_basic_type_dict(self) -> dict:
+        """
+        Return the dictionary of basic type name -> sizeof the type, "*" is the key of pointers
+        """
+        ptr_size = f'{4 * self.PLATFORM_BIT_SCALER}'
+        if self.PLATFORM_BIT_SCALER == 1:   # 32bit
+            sizeof_dict = self.sizeof_basic_c_type_dict_32bit
+        else:   # 64 bit
+            sizeof_dict = self.sizeof_basic_c_type_dict_64bit
+        sizeof_basic_type_dict = {'*': ptr_size}
+        for name, ttype in self.basic_type_dict.items():
+            if ttype.is_ptr:                            # is a pointer
+                sizeof_basic_type_dict[name] = ptr_size
+            elif ttype.base_type in sizeof_dict:
+                sizeof_basic_type_dict[name] = sizeof_dict[ttype.base_type]
+        for name in self.enum_class_name_list:
+            sizeof_basic_type_dict[name] = sizeof_dict['c_int']
+        return sizeof_basic_type_dict
 
-        return lines
+    def parse_sizeof_basic_type(self, lines: str) -> str:
+        return replace_sizeof_basic_type(lines, self.get_sizeof_basic_type_dict())
 
     class _MacroFunc:
         """
@@ -227,102 +523,471 @@ class PreProcessor(CommonParser):
             self.param_list = list()
             self.value = None           # string representing the value of macro
 
-    class _Node:
+    class _CExpr:
         """
-        Class used in topological sorting
+        Parser of C constant expressions, e.g. the value of a macro, an enum member, an array dimension or an #if clause.
+        The expression is parsed into a tree of tuples, the trees of the latest expressions are cached by their text:
+            ('num', value, c_type)      c_type is (bits, is_unsigned) for integers and None for floats
+            ('int', value, is_decimal, suffix)                      integer literal, typed when it is evaluated
+            ('name', identifier)        ('defined', identifier)     ('sizeof', type_names, ptr_depth)
+            ('unary', op, node)         ('binary', op, left, right)
+            ('cond', node, node, node)  ('cast', type_names, ptr_depth, node)
         """
-        def __init__(self, item):
-            self.in_nodes = list()
-            self.out_nodes = list()
-            self.item = item        # name of header file, string or list
+        binary_priority = {'||': 1, '&&': 2, '|': 3, '^': 4, '&': 5, '==': 6, '!=': 6, '<': 7, '<=': 7, '>': 7, '>=': 7,
+                           '<<': 8, '>>': 8, '+': 9, '-': 9, '*': 10, '/': 10, '%': 10}
+        c_type_keywords = {'char', 'short', 'int', 'long', 'unsigned', 'signed', 'float', 'double', 'void', '_Bool', 'bool'}
+        escape_dict = {'n': 10, 't': 9, 'r': 13, '0': 0, 'a': 7, 'b': 8, 'f': 12, 'v': 11, '\\': 92, "'": 39, '"': 34, '?': 63}
+
+        def __init__(self, text: str):
+            self.tokens = list()
+            pos = 0
+            text = text.strip()
+            while pos < len(text):
+                m = c_expr_token_pattern.match(text, pos)
+                if not m:
+                    raise CExprError(f'Unexpected character in C expression: {text[pos:]}')
+                pos = m.end()
+                if m.lastgroup != 'space':
+                    self.tokens.append((m.lastgroup, m.group()))
+            self.pos = 0
+
+        @classmethod
+        @functools.lru_cache(maxsize=65536)
+        def parse(cls, text: str) -> tuple:
+            expr = cls(text)
+            if not expr.tokens:
+                raise CExprError('Empty C expression')
+            ast = expr.parse_cond()
+            if expr.pos != len(expr.tokens):
+                raise CExprError(f'Unexpected token in C expression: {expr.tokens[expr.pos][1]}')
+            return ast
+
+        def peek(self, offset=0):
+            if self.pos + offset < len(self.tokens):
+                return self.tokens[self.pos + offset]
+            return None, None
+
+        def expect(self, value: str):
+            if self.peek()[1] != value:
+                raise CExprError(f'"{value}" is expected in C expression')
+            self.pos += 1
+
+        def parse_cond(self) -> tuple:
+            node = self.parse_binary(1)
+            if self.peek()[1] == '?':
+                self.pos += 1
+                true_node = self.parse_cond()
+                self.expect(':')
+                node = ('cond', node, true_node, self.parse_cond())
+            return node
+
+        def parse_binary(self, priority: int) -> tuple:
+            node = self.parse_unary()
+            while True:
+                op = self.peek()[1]
+                op_priority = self.binary_priority.get(op)
+                if self.peek()[0] != 'op' or op_priority is None or op_priority < priority:
+                    return node
+                self.pos += 1
+                node = ('binary', op, node, self.parse_binary(op_priority + 1))
 
-    class _NodeList:
+        def parse_type_name(self, is_sizeof=False):
+            """
+            Try to parse "type_name *)" after "(", return (None, 0) if it is not a type name
+            """
+            names = list()
+            offset = 0
+            while self.peek(offset)[0] == 'name':
+                names.append(self.peek(offset)[1])
+                offset += 1
+            ptr_depth = 0
+            while self.peek(offset)[1] == '*':
+                ptr_depth += 1
+                offset += 1
+            if not names or self.peek(offset)[1] != ')':
+                return None, 0
+            # (A) -1 is ambiguous, only regard it as a cast if it is a C keyword, a pointer or has several words
+            kind, value = self.peek(offset + 1)
+            if is_sizeof or kind in ('num', 'char', 'name') or value in ('(', '~', '!') \
+                    or len(names) > 1 or ptr_depth or names[0] in self.c_type_keywords:
+                self.pos += offset + 1
+                return tuple(names), ptr_depth
+            return None, 0
+
+        def parse_unary(self) -> tuple:
+            kind, value = self.peek()
+            if kind is None:
+                raise CExprError('Incomplete C expression')
+            self.pos += 1
+            if value in ('+', '-', '~', '!'):
+                return 'unary', value, self.parse_unary()
+            elif kind == 'num':
+                return self.parse_number(value)
+            elif kind == 'char':
+                return 'num', self.parse_char(value), (32, False)
+            elif value == 'defined':
+                has_bracket = self.peek()[1] == '('
+                if has_bracket:
+                    self.pos += 1
+                kind, value = self.peek()
+                if kind != 'name':
+                    raise CExprError('Macro name is expected after "defined"')
+                self.pos += 1
+                if has_bracket:
+                    self.expect(')')
+                return 'defined', value
+            elif value == 'sizeof':
+                self.expect('(')
+                type_names, ptr_depth = self.parse_type_name(is_sizeof=True)
+                if type_names is None:
+                    raise CExprError('Only sizeof(type) is supported in C expression')
+                return 'sizeof', type_names, ptr_depth
+            elif kind == 'name':
+                return 'name', value
+            elif value == '(':
+                type_names, ptr_depth = self.parse_type_name()
+                if type_names is not None:
+                    return 'cast', type_names, ptr_depth, self.parse_unary()
+                node = self.parse_cond()
+                self.expect(')')
+                return node
+            raise CExprError(f'Unexpected token in C expression: {value}')
+
+        @staticmethod
+        def parse_number(text: str) -> tuple:
+            digits = text.rstrip('uUlL')
+            suffix = text[len(digits):].lower()
+            if digits[:2] in ('0x', '0X'):
+                return 'int', int(digits[2:], 16), False, suffix
+            elif digits[:2] in ('0b', '0B'):
+                return 'int', int(digits[2:], 2), False, suffix
+            elif digits.isdigit():
+                if len(digits) > 1 and digits[0] == '0':
+                    try:
+                        return 'int', int(digits, 8), False, suffix
+                    except ValueError:
+                        raise CExprError(f'Invalid octal number: {text}')
+                return 'int', int(digits), True, suffix
+            return 'num', float(text.rstrip('fFlL')), None
+
+        def parse_char(self, text: str) -> int:
+            body = text[1:-1]
+            if not body.startswith('\\'):
+                if len(body) != 1:
+                    raise CExprError(f'Unsupported character constant: {text}')
+                return ord(body)
+            if body[1] in 'xX':
+                return int(body[2:], 16)
+            if body[1:].isdigit():
+                return int(body[1:], 8)
+            if body[1:] in self.escape_dict:
+                return self.escape_dict[body[1:]]
+            raise CExprError(f'Unsupported character constant: {text}')
+
+    class _Source:
+        def __init__(self, lines: str, include_list=None):
+            self.lines = lines              # cleaned code
+            if include_list is None:
+                include_list = include_pattern.findall(lines)
+            self.include_list = include_list    # file names in "#include", in order
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    def get_cache_path(self) -> str:
+        return os.path.join('output', 'parse_cache.json')
+
+    def load_cache(self):
         """
-        The topography of node
+        Load the results of the last run, so that the files that are not changed are not cleaned and preprocessed again.
+        Set "use_cache" to false in config to disable it.
         """
-        def __init__(self):
-            self.nodes = list()
-            self.node_items = list()
+        if not self.env.get('use_cache', True):
+            self.cache_dict = None
+            return
+        if self.cache_dict is None:         # otherwise it is kept in memory from the last run, see watch.py
+            try:
+                with open(self.get_cache_path(), 'r') as fp:
+                    cache_dict = json.load(fp)
+            except (OSError, ValueError):
+                cache_dict = dict()
+            if not isinstance(cache_dict, dict) or cache_dict.get('version') != parse_cache_version:
+                cache_dict = dict()
+            self.cache_dict = {stage: cache_dict.get(stage, dict()) for stage in ('sources', 'macros', 'replaced')}
+        self.new_cache_dict = {stage: dict() for stage in self.cache_dict}
+
+    def save_cache(self):
+        """
+        Save the results used in this run, the outdated ones are dropped
+        """
+        if self.new_cache_dict is None:
+            return
+        if not os.path.exists('output'):
+            os.mkdir('output')
+        try:
+            write_output_file(self.get_cache_path(), json.dumps(dict(version=parse_cache_version, **self.new_cache_dict)))
+        except OSError:
+            logging.error(f'Unable to save cache file {self.get_cache_path()}')
+
+    def get_cache(self, stage: str, key: str):
+        if self.cache_dict is None:
+            return None
+        return self.cache_dict[stage].get(key)
 
-        def __getitem__(self, idx):
-            return self.nodes[idx]
+    def set_cache(self, stage: str, key: str, value):
+        if self.new_cache_dict is not None:
+            self.new_cache_dict[stage][key] = value
 
-        def __iter__(self):
-            self.current_index = 0
-            return self
+    def map_in_workers(self, func, items: list) -> list:
+        """
+        Return [func(item) for item in items]. The items are processed in the pool of processes if "workers" > 1 in
+        config, func must be a module level function then. The order of results is kept.
+        """
+        if self.executor is None or len(items) < 2:
+            return [func(item) for item in items]
+        chunk_size = max(1, len(items) // (4 * self.env['workers']))
+        return list(self.executor.map(func, items, chunksize=chunk_size))
 
-        def __next__(self):
-            if self.current_index == len(self.nodes):
-                raise StopIteration
+    def read_sources(self, files: list, is_h_file: bool):
+        """
+        Read and clean the source files only once in a run, both include scanning and pre-processing use the result.
+        Only the leading preprocessor section of a C file is read, since we just need its "#include" lines.
+        """
+        new_files = list()
+        new_lines_list = list()
+        for file in files:
+            if file in self.source_dict:            # kept from the last run, see watch.py
+                cache = self.get_cache('sources', file)
+                if cache is not None:
+                    self.set_cache('sources', file, cache)
+                continue
+            with open(file, 'r') as fp:
+                lines = fp.read() if is_h_file else self.read_leading_directives(fp)
+            self.count('bytes_read', len(lines))
+            file_hash = self.hash_text(lines)
+            cache = self.get_cache('sources', file)
+            if cache is not None and cache['hash'] == file_hash:
+                self.source_dict[file] = self._Source(cache['lines'], cache['include_list'])
+                self.set_cache('sources', file, cache)
             else:
-                result = self.nodes[self.current_index]
-                self.current_index += 1
-                return result
+                new_files.append(file)
+                new_lines_list.append((lines, file_hash))
 
-        def get_node_by_name(self, name: str):
-            for node in self.nodes:
-                if node.item == name:
-                    return node
-            return None
+        cleaned_lines_list = self.map_in_workers(rm_miscellenous, [lines for lines, _ in new_lines_list])
+        for file, (_, file_hash), lines in zip(new_files, new_lines_list, cleaned_lines_list):
+            source = self.source_dict[file] = self._Source(lines)
+            self.set_cache('sources', file, dict(hash=file_hash, lines=source.lines, include_list=source.include_list))
+
+    @staticmethod
+    def read_leading_directives(fp) -> str:
+        """
+        Read the lines from the beginning of file until the first line of code which is neither a preprocessor
+        directive nor a comment. A comment opened in a directive may go on in the following lines.
+        """
+        lines = list()
+        in_comment = False
+        in_directive = False        # the previous directive line ends with a backslash
+        for line in fp:
+            rest = line.strip()
+            if in_directive:
+                in_directive = rest.endswith('\\')
+                in_comment = is_comment_open(rest, in_comment)
+                lines.append(line)
+                continue
+            while rest:
+                if in_comment:
+                    end = rest.find('*/')
+                    if end < 0:
+                        break
+                    in_comment = False
+                    rest = rest[end + 2:].lstrip()
+                elif rest.startswith('/*'):
+                    in_comment = True
+                    rest = rest[2:]
+                elif rest.startswith('#'):
+                    in_directive = rest.endswith('\\')
+                    in_comment = is_comment_open(rest)
+                    break
+                elif not rest.startswith('//'):
+                    return ''.join(lines)
+                else:
+                    break
+            lines.append(line)
+        return ''.join(lines)
 
     def pre_process(self):
         self.h_files = self.sort_h_files()
         for h_file in self.h_files:
-            with open(h_file, 'r') as fp:
-                lines = fp.read()
-                lines = rm_miscellenous(lines)
-                self.intermediate_h_files.append(lines)
+            self.intermediate_h_files.append(self.source_dict[h_file].lines)
+
+    def topo_sort(self, components: list) -> list:
+        """
+        Kahn's algorithm over the graph of components. Among the components without unsorted predecessors, the one that
+        finished first in the DFS goes first, so an include graph without loop keeps its usual order.
+        """
+        component_idx_dict = dict()
+        for idx, component in enumerate(components):
+            for item in component:
+                component_idx_dict[item] = idx
+
+        out_components = [dict() for _ in components]
+        in_degrees = [0] * len(components)
+        for item, next_items in self.include_graph.items():
+            idx = component_idx_dict[item]
+            for next_item in next_items:
+                next_idx = component_idx_dict[next_item]
+                if next_idx != idx and next_idx not in out_components[idx]:
+                    out_components[idx][next_idx] = None
+                    in_degrees[next_idx] += 1
 
-    def topo_sort(self):
         sorted_list = list()
-        while self.node_list.nodes:
-            zero_in_node = None
-            for node in self.node_list:
-                if not node.in_nodes:
-                    zero_in_node = node
-                    break
-            if zero_in_node:
-                self.node_list.nodes.remove(zero_in_node)
-                if isinstance(zero_in_node.item, str):
-                    sorted_list.append(zero_in_node.item)
-                else:   # is list
-                    sorted_list.extend(zero_in_node.item)
-                for node in self.node_list.nodes:
-                    if zero_in_node in node.in_nodes:
-                        node.in_nodes.remove(zero_in_node)
-            else:
-                logging.error("topography has loop!!!")
-                break
+        zero_in_heap = [idx for idx, in_degree in enumerate(in_degrees) if not in_degree]
+        while zero_in_heap:
+            idx = heapq.heappop(zero_in_heap)
+            sorted_list.extend(components[idx])
+            for next_idx in out_components[idx]:
+                in_degrees[next_idx] -= 1
+                if not in_degrees[next_idx]:
+                    heapq.heappush(zero_in_heap, next_idx)
 
         return sorted_list
 
-    def fill_in_node_list(self, include_list: list):
-        if include_list:
-            prev_node = None
-            for include_item in include_list:
-                if include_item not in self.node_list.node_items:
-                    node = self._Node(include_item)
-                    self.node_list.nodes.append(node)
-                    self.node_list.node_items.append(include_item)
-                else:
-                    node = self.node_list.get_node_by_name(include_item)
-
-                if prev_node and prev_node is not node and node not in prev_node.out_nodes:
-                    prev_node.out_nodes.append(node)
-                prev_node = node
+    def fill_in_include_graph(self, include_list: list):
+        prev_item = None
+        for include_item in include_list:
+            self.include_graph.setdefault(include_item, dict())         # dict is used as an ordered set here
+            if prev_item is not None and prev_item != include_item:
+                self.include_graph[prev_item].setdefault(include_item)
+            prev_item = include_item
 
     def generate_node_graph(self, file_list: list, is_h_file: bool):
-        quick_table = [os.path.basename(h_file) for h_file in self.h_files]
+        quick_table = dict()
+        for h_file in self.h_files:
+            quick_table.setdefault(os.path.basename(h_file), h_file)
 
+        self.read_sources(file_list, is_h_file)
         for file in file_list:
-            with open(file, 'r') as fp:
-                lines = fp.read()
-                lines = rm_miscellenous(lines)
-                include_list = re.findall(r'#include\s+["<](\w+.h)[">]\s*', lines)
-                include_list = [self.h_files[quick_table.index(os.path.basename(i))] for i in include_list if os.path.basename(i) in quick_table]
-                if is_h_file:
-                    include_list.append(file)
-                self.fill_in_node_list(include_list)
+            include_list = self.source_dict[file].include_list
+            include_list = [quick_table[os.path.basename(i)] for i in include_list if os.path.basename(i) in quick_table]
+            if is_h_file:
+                include_list.append(file)
+            self.fill_in_include_graph(include_list)
+
+    def find_include_loops(self, graph=None) -> list:
+        """
+        Find the loops of including (strongly connected components) with Tarjan's algorithm in one DFS.
+        Return the components in the order the DFS finishes them. In each component, the file where the DFS entered the
+        loop goes first, followed by the rest of the loop from the deepest file back up.
+        Another graph in the same format as include_graph can be given, e.g. the imports between generated modules.
+        """
+        if graph is None:
+            graph = self.include_graph
+        dfs_idx_dict = dict()
+        low_link_dict = dict()
+        stack = list()
+        on_stack = set()
+        components = list()
+        for root in graph:
+            if root in dfs_idx_dict:
+                continue
+            dfs_idx_dict[root] = low_link_dict[root] = len(dfs_idx_dict)
+            stack.append(root)
+            on_stack.add(root)
+            work_stack = [(root, iter(graph[root]))]
+            while work_stack:
+                item, next_items = work_stack[-1]
+                for next_item in next_items:
+                    if next_item not in dfs_idx_dict:
+                        dfs_idx_dict[next_item] = low_link_dict[next_item] = len(dfs_idx_dict)
+                        stack.append(next_item)
+                        on_stack.add(next_item)
+                        work_stack.append((next_item, iter(graph[next_item])))
+                        break
+                    elif next_item in on_stack:
+                        low_link_dict[item] = min(low_link_dict[item], dfs_idx_dict[next_item])
+                else:       # all the next items are visited
+                    work_stack.pop()
+                    if work_stack:
+                        parent = work_stack[-1][0]
+                        low_link_dict[parent] = min(low_link_dict[parent], low_link_dict[item])
+                    if low_link_dict[item] == dfs_idx_dict[item]:
+                        component = list()
+                        while stack[-1] != item:
+                            component.append(stack.pop())
+                            on_stack.discard(component[-1])
+                        stack.pop()
+                        on_stack.discard(item)
+                        components.append([item] + component)
+
+        return components
+
+    def squeeze_include_loops(self) -> list:
+        """
+        Find the loops of including in DFS over include_graph the way the old node graph did, so that the order of the
+        header files stays the same: the first loop found is squeezed into one node, whose files are the file where the
+        DFS entered the loop followed by the rest of the loop from the deepest file back up. The files on the path to the
+        loop are put back in front of the untouched ones and the DFS starts again from the first of them.
+        Return the files of each node in the order the DFS finishes them.
+        """
+        node_idx_dict = {item: idx for idx, item in enumerate(self.include_graph)}
+        items = [[item] for item in self.include_graph]         # files of each node, the index is the id of node
+        out_nodes = [[node_idx_dict[next_item] for next_item in next_items] for next_items in self.include_graph.values()]
+        in_nodes = [set() for _ in items]
+        for idx, next_idxs in enumerate(out_nodes):
+            for next_idx in next_idxs:
+                in_nodes[next_idx].add(idx)
+
+        untouched_queue = collections.deque(range(len(items)))    # the nodes visited since are skipped
+        untouched_set = set(untouched_queue)
+        finished_list = list()
+        while untouched_set:
+            root = untouched_queue.popleft()
+            if root not in untouched_set:
+                continue
+            path = [root]
+            path_idx_dict = {root: 0}       # key = node on the path, value = its index in path
+            untouched_set.discard(root)
+            work_stack = [iter(out_nodes[root])]
+            loop = None
+            while work_stack and loop is None:
+                for next_idx in work_stack[-1]:
+                    if next_idx in path_idx_dict:
+                        loop = [next_idx] + path[:path_idx_dict[next_idx]:-1]
+                        break
+                    elif next_idx in untouched_set:
+                        path_idx_dict[next_idx] = len(path)
+                        path.append(next_idx)
+                        untouched_set.discard(next_idx)
+                        work_stack.append(iter(out_nodes[next_idx]))
+                        break
+                else:       # all the next nodes are finished
+                    work_stack.pop()
+                    finished_list.append(path.pop())
+                    del path_idx_dict[finished_list[-1]]
+            if loop is None:
+                continue
+
+            loop_set = set(loop)
+            squeezed_idx = len(items)
+            items.append([item for idx in loop for item in items[idx]])
+            out_nodes.append(list(dict.fromkeys(next_idx for idx in loop for next_idx in out_nodes[idx]
+                                                if next_idx not in loop_set)))
+            in_nodes.append(set().union(*(in_nodes[idx] for idx in loop)) - loop_set)
+            for prev_idx in in_nodes[squeezed_idx]:
+                out_nodes[prev_idx] = [next_idx for next_idx in out_nodes[prev_idx] if next_idx not in loop_set]
+                out_nodes[prev_idx].append(squeezed_idx)
+            for next_idx in out_nodes[squeezed_idx]:
+                in_nodes[next_idx] -= loop_set
+                in_nodes[next_idx].add(squeezed_idx)
+
+            path = path[:path_idx_dict[loop[0]]]
+            untouched_queue.extendleft(reversed(path))
+            untouched_queue.append(squeezed_idx)
+            untouched_set.update(path)
+            untouched_set.add(squeezed_idx)
+
+        return [items[idx] for idx in finished_list]
 
     def sort_h_files(self) -> list:
         """
@@ -339,97 +1004,245 @@ class PreProcessor(CommonParser):
         self.generate_node_graph(self.h_files, is_h_file=True)
         self.generate_node_graph(self.c_files, is_h_file=False)
 
-        for node in self.node_list.nodes:
-            for out_node in node.out_nodes:
-                out_node.in_nodes.append(node)
-
-        # Step2: remove loop, and then squeeze them into one node
-        while self.node_list.nodes:
-            node = self.node_list.nodes[0]
-            self.dfs_node(node)
-            if self.detected_loop:     # There is a loop
-                self.node_list.nodes = self.visited_list + self.node_list.nodes
-                self.visited_list = list()
-                self.detected_loop = False
-                self.squeezed_flag = False
-
-        self.node_list.nodes = self.fully_visited_list
+        # Step2: find loops, each of them is squeezed into one node
+        components = self.squeeze_include_loops()
 
         # Step3: topo sort
-        return self.topo_sort()
+        return self.topo_sort(components)
 
-    @staticmethod
-    def update_node_list(squeezed_node: _Node, loop_node_list: list, in_out_node_list: list) -> list:
-        new_in_out_node_list = [in_node for in_node in in_out_node_list if in_node not in loop_node_list]
-        if len(in_out_node_list) != len(new_in_out_node_list):
-            new_in_out_node_list.append(squeezed_node)
-
-        return new_in_out_node_list
-
-    def squeeze_into_one_node(self, loop_node_list: list):
-        in_nodes = list()
-        out_nodes = list()
-        items = list()
-        for node in loop_node_list:
-            in_nodes = in_nodes + [in_node for in_node in node.in_nodes if in_node not in loop_node_list]
-            out_nodes = out_nodes + [out_node for out_node in node.out_nodes if out_node not in loop_node_list]
-            if isinstance(node.item, str):
-                items.append(node.item)
-            else:       # is a list
-                items.extend(node.item)
-            self.visited_list.remove(node)
-
-        squeezed_node = self._Node(items)
-        squeezed_node.in_nodes = unique_list(in_nodes)
-        squeezed_node.out_nodes = unique_list(out_nodes)
-
-        # replace node in loop node list with the squeezed node
-        for node in self.node_list.nodes:
-            node.in_nodes = self.update_node_list(squeezed_node, loop_node_list, node.in_nodes)
-            node.out_nodes = self.update_node_list(squeezed_node, loop_node_list, node.out_nodes)
-        for node in self.visited_list:
-            node.in_nodes = self.update_node_list(squeezed_node, loop_node_list, node.in_nodes)  # This line is critical
-            node.out_nodes = self.update_node_list(squeezed_node, loop_node_list, node.out_nodes)
-        for node in self.fully_visited_list:
-            node.in_nodes = self.update_node_list(squeezed_node, loop_node_list, node.in_nodes)
-
-        self.node_list.nodes.append(squeezed_node)
-
-    def dfs_node(self, node: _Node):
-        if self.squeezed_flag:
-            return None
-
-        if not self.detected_loop:
-            self.visited_list.append(node)
-            self.node_list.nodes.remove(node)
-
-        for out_node in node.out_nodes:
-            if out_node in self.visited_list and not self.detected_loop:
-                self.detected_loop = True
-                return [out_node, node]                 # only returning [out_node] causes bug
-            elif out_node in self.node_list.nodes and not self.squeezed_flag:   # in untouched list
-                ret = self.dfs_node(out_node)
-                if not ret:
-                    continue
-                if ret[0] == node:
-                    self.squeeze_into_one_node(ret)
-                    self.squeezed_flag = True
-                    return None
-                else:
-                    return ret + [node]
-            else:   # node in fully visited list or in a traceback process
-                continue
+    def eval_c_expr(self, expr: str, is_if_clause=False):
+        """
+        Evaluate a C constant expression with C semantics: integer division truncates toward zero, unsigned arithmetic
+        wraps around and casts truncate the value to the size of the type. Signed overflow is undefined in C, the exact
+        value is kept in that case.
+        Identifiers are looked up in macro_dict. In #if clause, "defined" is allowed, unknown identifiers are 0 and the
+        integers have the width of intmax_t and uintmax_t, i.e. 64 bits. Return an int or a float. CExprError is raised if the expression cannot be evaluated.
+        """
+        try:
+            return self.eval_c_expr_node(self._CExpr.parse(expr), is_if_clause, frozenset())[0]
+        except CExprError:
+            self.count('c_expr_failures')
+            raise
 
-        if not self.detected_loop:
-            self.fully_visited_list.append(node)
-            self.visited_list.remove(node)
+    def eval_c_expr_node(self, node: tuple, is_if_clause: bool, visiting: frozenset) -> tuple:
+        """
+        Evaluate a node of the tree from _CExpr.parse, return (value, c_type)
+        """
+        kind = node[0]
+        if kind == 'num':
+            return node[1], node[2]
+        elif kind == 'int':
+            return node[1], self.get_c_int_literal_type(node[1], node[2], node[3], is_if_clause)
+        elif kind == 'name':
+            return self.eval_c_macro(node[1], is_if_clause, visiting)
+        elif kind == 'defined':
+            if not is_if_clause:
+                raise CExprError('"defined" is only allowed in #if clause')
+            if self.c_macro_name_stack:
+                self.c_macro_name_stack[-1].add(node[1])
+            return int(node[1] in self.macro_dict), (32, False)
+        elif kind == 'sizeof':
+            return self.get_c_type_size(node[1], node[2]), (32 * self.PLATFORM_BIT_SCALER, True)
+        elif kind == 'cast':
+            value, c_type = self.eval_c_expr_node(node[3], is_if_clause, visiting)
+            _, c_type = self.get_c_basic_type_info(node[1], node[2])
+            if c_type is None:
+                return float(value), None
+            return self.truncate_c_int(int(value), c_type), c_type
+        elif kind == 'cond':
+            value, _ = self.eval_c_expr_node(node[1], is_if_clause, visiting)
+            return self.eval_c_expr_node(node[2] if value else node[3], is_if_clause, visiting)
+        elif kind == 'unary':
+            value, c_type = self.eval_c_expr_node(node[2], is_if_clause, visiting)
+            op = node[1]
+            if op == '!':
+                return int(not value), (32, False)
+            if c_type is None:
+                if op == '~':
+                    raise CExprError('Operand of "~" must be an integer')
+                return (-value if op == '-' else value), None
+            int_bits = 64 if is_if_clause else 32
+            c_type = (max(c_type[0], int_bits), c_type[1] and c_type[0] >= int_bits)     # integer promotion
+            if op == '-':
+                value = -value
+            elif op == '~':
+                value = ~value
+            return self.truncate_c_int(value, c_type) if c_type[1] else value, c_type
+
+        # binary operators
+        op = node[1]
+        left, left_type = self.eval_c_expr_node(node[2], is_if_clause, visiting)
+        if op == '&&' or op == '||':
+            if bool(left) == (op == '||'):          # short circuit
+                return int(bool(left)), (32, False)
+            right, _ = self.eval_c_expr_node(node[3], is_if_clause, visiting)
+            return int(bool(right)), (32, False)
+        right, right_type = self.eval_c_expr_node(node[3], is_if_clause, visiting)
+
+        if left_type is None or right_type is None:     # float arithmetic
+            if op in self.c_compare_op_dict:
+                return int(self.c_compare_op_dict[op](left, right)), (32, False)
+            if op == '/':
+                if right == 0:
+                    raise CExprError('Division by zero in C expression')
+                return left / right, None
+            if op in ('+', '-', '*'):
+                return self.c_arithmetic_op_dict[op](left, right), None
+            raise CExprError(f'Operands of "{op}" must be integers')
+
+        int_bits = 64 if is_if_clause else 32
+        left_type = (max(left_type[0], int_bits), left_type[1] and left_type[0] >= int_bits)       # integer promotion
+        right_type = (max(right_type[0], int_bits), right_type[1] and right_type[0] >= int_bits)
+        if op == '<<' or op == '>>':
+            if right < 0:
+                raise CExprError('Negative shift count in C expression')
+            c_type = left_type
+            value = left << right if op == '<<' else left >> right
+        else:
+            # usual arithmetic conversions
+            if left_type[0] == right_type[0]:
+                c_type = (left_type[0], left_type[1] or right_type[1])
+            else:
+                c_type = max(left_type, right_type)
+            if c_type[1]:
+                left = self.truncate_c_int(left, c_type)
+                right = self.truncate_c_int(right, c_type)
+            if op in self.c_compare_op_dict:
+                return int(self.c_compare_op_dict[op](left, right)), (32, False)
+            elif op == '/' or op == '%':
+                if right == 0:
+                    raise CExprError('Division by zero in C expression')
+                value = abs(left) // abs(right)
+                if (left < 0) != (right < 0):
+                    value = -value
+                if op == '%':
+                    value = left - right * value
+            else:
+                value = self.c_arithmetic_op_dict[op](left, right)
+        return self.truncate_c_int(value, c_type) if c_type[1] else value, c_type
 
-        return None
+    def eval_c_macro(self, name: str, is_if_clause: bool, visiting: frozenset) -> tuple:
+        """
+        Get the value of a macro in C expression. Macros defined as text are evaluated once and memorized, the value is
+        forgotten once the macro or a macro it uses changes, see forget_changed_macros().
+        """
+        self.forget_changed_macros()
+        if self.c_macro_name_stack:
+            self.c_macro_name_stack[-1].add(name)
+        key = (name, is_if_clause)
+        if key in self.c_macro_value_dict:
+            return self.c_macro_value_dict[key]
+
+        if name not in self.macro_dict:
+            if is_if_clause:
+                return 0, (32, False)
+            raise CExprError(f'Unknown identifier in C expression: {name}')
+        value = self.macro_dict[name]
+        used_names = {name}
+        if isinstance(value, float):
+            ret = value, None
+        elif isinstance(value, int):
+            ret = int(value), self.get_c_int_literal_type(int(value), False, '', is_if_clause)
+        else:
+            if name in visiting:
+                raise CExprError(f'Recursive macro in C expression: {name}')
+            self.c_macro_name_stack.append(used_names)
+            try:
+                ret = self.eval_c_expr_node(self._CExpr.parse(value), is_if_clause, visiting | {name})
+            except CExprError:
+                if len(self.c_macro_name_stack) > 1:    # nothing is memorized, the caller uses those macros instead
+                    self.c_macro_name_stack[-2].update(used_names)
+                raise
+            finally:
+                self.c_macro_name_stack.pop()
+        self.c_macro_value_dict[key] = ret
+        for used_name in used_names:
+            self.c_macro_user_dict.setdefault(used_name, set()).add(key)
+        return ret
+
+    def forget_changed_macros(self):
+        """
+        Drop the memorized values of macros and #if clauses which use the macros changed since the last call, directly
+        or through other macros
+        """
+        changed_names = self.macro_dict.changed_names
+        if self.c_macro_change_count == len(changed_names):
+            return
+        name_list = changed_names[self.c_macro_change_count:]
+        self.c_macro_change_count = len(changed_names)
+        while name_list:
+            for key in self.c_macro_user_dict.pop(name_list.pop(), ()):
+                if isinstance(key, tuple):          # value of a macro, which is used by other macros in turn
+                    if self.c_macro_value_dict.pop(key, None) is not None:
+                        name_list.append(key[0])
+                else:                               # #if clause
+                    self.if_clause_dict.pop(key, None)
+
+    def get_c_int_literal_type(self, value: int, is_decimal: bool, suffix: str, is_if_clause=False) -> tuple:
+        """
+        Get the C type of an integer literal, int, long or long long, unsigned or not. In #if clause, it is intmax_t or
+        uintmax_t.
+        """
+        long_bits = 32 * self.PLATFORM_BIT_SCALER
+        is_unsigned = 'u' in suffix
+        long_count = suffix.count('l')
+        candidates = [(32, long_bits, 64), (long_bits, 64), (64,)][2 if is_if_clause else min(long_count, 2)]
+        for bits in candidates:
+            if not is_unsigned and value < 2 ** (bits - 1):
+                return bits, False
+            if (is_unsigned or not is_decimal) and value < 2 ** bits:
+                return bits, True
+        return 64, True
+
+    def get_c_basic_type_info(self, type_names: tuple, ptr_depth: int) -> tuple:
+        """
+        Get the size and C type of a basic type used in cast and sizeof, e.g. (unsigned long), (MY_U32 *)
+        """
+        pointer_info = (4 * self.PLATFORM_BIT_SCALER, (32 * self.PLATFORM_BIT_SCALER, True))
+        if ptr_depth:
+            return pointer_info
+        type_name = ' '.join(type_names)
+        if self.basic_type_dict.__contains__(type_name):
+            if self.basic_type_dict[type_name].is_ptr:
+                return pointer_info
+            ctypes_name = self.basic_type_dict[type_name].base_type
+        elif self.get_symbol_kind(type_name) == 'enum':
+            ctypes_name = 'c_int'
+        else:
+            ctypes_name = dict(zip(self.basic_c_type_keys, self.basic_ctypes_lib_vars)).get(type_name)
+            if type_name == 'unsigned':
+                ctypes_name = 'c_uint'
+        if ctypes_name not in self.sizeof_basic_c_type_dict_32bit:
+            raise CExprError(f'Unknown type in C expression: {type_name}')
+
+        if self.PLATFORM_BIT_SCALER == 1:   # 32bit
+            size = int(self.sizeof_basic_c_type_dict_32bit[ctypes_name])
+        else:   # 64 bit
+            size = int(self.sizeof_basic_c_type_dict_64bit[ctypes_name])
+        if ctypes_name in ('c_float', 'c_double', 'c_longdouble'):
+            return size, None
+        return size, (size * 8, ctypes_name in self.unsigned_ctypes_lib_vars)
+
+    def get_c_type_size(self, type_names: tuple, ptr_depth: int) -> int:
+        """
+        Get sizeof a type in C expression, see StructUnionParser.get_c_type_size() for structures
+        """
+        return self.get_c_basic_type_info(type_names, ptr_depth)[0]
 
-    def parse_macro(self, lines: str):
+    @staticmethod
+    def truncate_c_int(value: int, c_type: tuple) -> int:
+        bits, is_unsigned = c_type
+        value &= (1 << bits) - 1
+        if not is_unsigned and value >> (bits - 1):
+            value -= 1 << bits
+        return value
+
+    def parse_macro(self, lines: str) -> list:
         """
         Parse the #define clause within lines and append the macros to the macro dictionary
+        Return the list of [name, value] appended, in order.
         """
+        new_macro_list = list()
         macro_list = re.findall(r'#define\s+(\w+)\b(.*)\n', lines)
         for item in macro_list:
             val = item[1].strip()
@@ -438,129 +1251,174 @@ class PreProcessor(CommonParser):
                 self.macro_dict[item[0]] = val
             else:
                 try:
-                    value = eval(val)
-                    if isinstance(value, int) or isinstance(value, float):
-                        self.macro_dict[item[0]] = value
+                    self.macro_dict[item[0]] = self.eval_c_expr(val)
+                except CExprError:
+                    if not item[1].startswith('(') and ('sizeof' in val or any(
+                            'sizeof' in str(self.macro_dict.get(name, '')) for name in c_identifier_pattern.findall(val))):
+                        # sizeof() of structures and typedefs, which are parsed after macros, is evaluated when used
+                        self.macro_dict[item[0]] = f'({val})'
                     else:
-                        # logging.error(f"Error in parsing macro {item[0]}\n")
+                        # macro function, or macro which is not a number
+                        # logging.warning(f'Unable to parse macro; {item[0]}')
                         continue
-                except Exception:
-                    for m, v in self.macro_dict.items():
-                        val = re.sub(r'\b{}\b'.format(m), '{}'.format(v), val)
-                    val = re.sub(r'\b(\d+)[uUlL]+\b', r'\1', val)
-                    val = re.sub(r'\b(0x[\da-fA-F]+)[uUlL]+\b', r'\1', val)
-                    try:
-                        value = eval(val)
-                        if isinstance(value, int) or isinstance(value, float):
-                            self.macro_dict[item[0]] = value
-                        else:
-                            # logging.warning(f"Unable to parse macro, {item[0]}\n")
-                            pass
-                    except Exception:
-                        if val.startswith('('):
-                            # macro function
-                            pass
-                        else:
-                            traceback.print_exc()
-                            # logging.warning(f'Unable to parse macro; {item[0]}')
-                            pass
-                            continue
+            new_macro_list.append([item[0], self.macro_dict[item[0]]])
+        return new_macro_list
+
+    def check_if_clause(self, expr: str) -> bool:
+        """
+        Evaluate the expression of #if/#elif clause. The result is cached until a macro it uses changes.
+        """
+        self.forget_changed_macros()
+        flag = self.if_clause_dict.get(expr)
+        if flag is None:
+            used_names = set()
+            self.c_macro_name_stack.append(used_names)
+            try:
+                flag = bool(self.eval_c_expr(expr, is_if_clause=True))
+            except CExprError:
+                flag = False                                    # unable to evaluate the criteria
+            finally:
+                self.c_macro_name_stack.pop()
+            self.if_clause_dict[expr] = flag
+            for used_name in used_names:
+                self.c_macro_user_dict.setdefault(used_name, set()).add(expr)
+        return flag
 
     def check_macro(self):
+        """
+        Keep the code in valid #if/#ifdef/#ifndef/#elif/#else blocks and parse the macros defined in them.
+        The result of a file is reused from cache if both the file and the macros defined before it are not changed.
+        The macros are tracked by a chained hash: the state after a file is the hash of the state before it and the
+        macros it defines, so editing a file only invalidates the files after it whose macros in effect have changed.
+        The typedefs and enums declared in the kept code are cached with it.
+        """
+        self.declaration_list = list()
+        self.check_macro_key_list = list()
+        macro_state = self.hash_text(json.dumps([self.macro_dict, self.PLATFORM_BIT_SCALER, self.target_abi], sort_keys=True))
         for i, lines in enumerate(self.intermediate_h_files):
-            lines = '\n' + self.intermediate_h_files[i] + '\n'        # append a pseudo new line here to make sure there must be some code before #ifdef and after #endif
-            # comment: len(blocks) = len(criterion)+1;
-            blocks = re.split(r'#if\s+defined\s+\w+\b\s*\n|#if.*\s*\n|#elif.*\s*\n|#ifndef\s+\w+\b\s*\n|#if\s+\w+\b\s*\n|#ifdef\s+\w+\b\s*\n|#endif|#else\s*\n|#elif\s+\w+\b\s*\n', lines)
-            criterion = re.findall(r'#if\s+defined\s+\w+\b\s*\n|#if.*\s*\n|#elif.*\s*\n|#ifndef\s+\w+\b\s*\n|#if\s+\w+\b\s*\n|#ifdef\s+\w+\b\s*\n|#endif|#else\s*\n|#elif\s+\w+\b\s*\n', lines)
-            criterion = [tmpCter.strip() for tmpCter in criterion]
-            tmpPattern = re.compile(r'(\d+)[uUlL]+')
-            criterion = [tmpPattern.subn(r'\1', tmpCter)[0] for tmpCter in criterion]
-            criterion = list(filter(None, criterion))
-
-            # Process the first code block here. It should always be valid.
-            code_block = blocks.pop(0)
-            self.parse_macro(code_block)
-            new_lines = code_block          # save result
-            flag_stack = deque()  # use a stack to remember whether the former criterion is valid
-            flag_stack.append(True)
-            is_ignore_else = True  # whether we should ignore the #else clause or not
-
-            while criterion:
-                criteria = criterion.pop(0)
-                code_block = blocks.pop(0)
-                # check ifndef, ifdef, if, if defined
-                if criteria.startswith('#ifndef'):
-                    macro = re.search(r'#ifndef\s+(\w+)', criteria).group(1)
-                    flag = (not self.macro_dict.__contains__(macro)) and flag_stack[-1]   # the validation before and after criteria both affect
-                    flag_stack.append(flag)
-                    is_ignore_else = not self.macro_dict.__contains__(macro)
-
-                elif criteria.startswith('#ifdef'):
-                    macro = re.search(r'#ifdef\s+(\w+)', criteria).group(1)
-                    flag = self.macro_dict.__contains__(macro) and flag_stack[-1]   # the validation before and after criteria both affect
-                    flag_stack.append(flag)
-                    is_ignore_else = self.macro_dict.__contains__(macro)
-
-                elif criteria.startswith('#endif'):
-                    flag_stack.pop()             # deque pop from right
-                    is_ignore_else = True
-                    try:
-                        flag = flag_stack[-1]
-                    except IndexError:
-                        traceback.print_exc()
-                        logging.error(f'Error in preprocessing file {self.h_files[i]}.')
-                elif criteria.startswith('#if') or criteria.startswith('#elif'):
-                    if criteria.startswith('#if'):
-                        expr = re.search(r'#if\s+(.+)', criteria).group(1)
-                    else:
-                        if is_ignore_else:
-                            continue
-                        expr = re.search(r'#elif\s+(.+)', criteria).group(1)
-                        flag_stack.pop()
-                    for key, val in self.c_operator_dict.items():       # replace c operator with python operator
-                        expr = expr.replace(key, val)
-                    for macro, val in self.macro_dict.items():          # replace macro with it original value
-                        expr = re.sub(r'\b{}\b'.format(macro), '{}'.format(val), expr)
+            key = self.hash_text(macro_state + self.hash_text(lines))
+            cache = self.get_cache('macros', key)
+            if cache is None:
+                new_lines, new_macro_list = self.check_macro_in_file(lines, self.h_files[i])
+                declarations = self.find_declarations(new_lines, declaration_pattern_dict)
+            else:
+                new_lines, new_macro_list, declarations = cache
+                for name, val in new_macro_list:
+                    self.macro_dict[name] = val
+            self.set_cache('macros', key, [new_lines, new_macro_list, declarations])
+            macro_state = self.hash_text(macro_state + json.dumps(new_macro_list))
+            self.intermediate_h_files[i] = new_lines
+            self.declaration_list.append(declarations)
+            self.check_macro_key_list.append(key)
 
-                    try:
-                        if eval(expr):
-                            flag = flag_stack[-1]
-                            is_ignore_else = True
-                        else:
-                            flag = False
-                            is_ignore_else = False
-                        flag_stack.append(flag)
-                    except Exception:
-                        flag = False                                     # not defined macro
-                        is_ignore_else = False
-                        flag_stack.append(flag)
-
-                elif criteria.startswith('#else'):
-                    if is_ignore_else:
-                        continue
-                    else:
-                        flag_stack.pop()
-                        is_ignore_else = True
-                        flag = flag_stack[-1]
-                        flag_stack.append(flag)
+    @staticmethod
+    def find_declarations(lines: str, pattern_dict: dict) -> dict:
+        """
+        Find the declarations in the code of a header file, key = kind of declaration, value = list of matches
+        """
+        return {kind: pattern.findall(lines) for kind, pattern in pattern_dict.items()}
+
+    def check_macro_in_file(self, lines: str, h_file: str) -> tuple:
+        """
+        The directives are visited in one pass with a stack of [is_parent_valid, is_any_branch_taken, is_valid];
+        code between two directives is only parsed and kept if the current block is valid.
+        Return the kept code and the list of macros defined in it.
+        """
+        new_lines = ['\n']                                  # keep a pseudo new line before and after the code
+        new_macro_list = list()
+        flag_stack = list()
+        flag = True
+        pos = 0
+        for m in conditional_directive_pattern.finditer(lines):
+            if flag and m.start() > pos:
+                code_block = lines[pos:m.start()]
+                new_macro_list.extend(self.parse_macro(code_block))
+                new_lines.append(code_block)
+            pos = m.end()
+
+            directive, criteria = m.group(1), m.group(2).strip()
+            if directive in ('if', 'ifdef', 'ifndef'):
+                if not flag:                                # no need to check the criteria in invalid block
+                    is_valid = False
+                elif directive == 'if':
+                    is_valid = self.check_if_clause(criteria)
                 else:
-                    logging.error(f"Unable to parse preprocessing clause : {criteria}")
+                    macro = re.match(r'\w+', criteria)
+                    if not macro:
+                        logging.error(f"Unable to parse preprocessing clause : #{directive} {criteria}")
+                    is_valid = bool(macro) and self.macro_dict.__contains__(macro.group()) == (directive == 'ifdef')
+                flag_stack.append([flag, is_valid, is_valid])
+            elif not flag_stack:
+                logging.error(f'Error in preprocessing file {h_file}. #{directive} without #if')
+                continue
+            elif directive == 'endif':
+                flag_stack.pop()
+            elif directive == 'else':
+                flag_stack[-1][2] = flag_stack[-1][0] and not flag_stack[-1][1]
+                flag_stack[-1][1] = True
+            else:       # elif
+                is_valid = flag_stack[-1][0] and not flag_stack[-1][1] and self.check_if_clause(criteria)
+                flag_stack[-1][2] = is_valid
+                flag_stack[-1][1] = flag_stack[-1][1] or is_valid
+            flag = flag_stack[-1][2] if flag_stack else True
+
+        if flag and pos < len(lines):
+            code_block = lines[pos:]
+            new_macro_list.extend(self.parse_macro(code_block + '\n'))
+            new_lines.append(code_block)
+        if flag_stack:
+            logging.error(f'Error in preprocessing file {h_file}. #endif is missing')
+        new_lines.append('\n')
+        return ''.join(new_lines), new_macro_list
+
+    def generate_macro_expansion_dict(self):
+        """
+        Macros used to be replaced one by one in the order of macro_dict, so the value of a macro was further replaced by
+        the macros after it. Resolve those values once, from the last macro to the first one, and the C code can be
+        replaced in a single scan.
+        """
+        expansion_dict = dict()
 
-                if flag:
-                    self.parse_macro(code_block)
-                    new_lines += code_block
+        def expand(m):
+            return expansion_dict.get(m.group(), m.group())
 
-            self.intermediate_h_files[i] = new_lines
+        for macro, val in reversed(list(self.macro_dict.items())):
+            expansion_dict[macro] = c_identifier_pattern.sub(expand, '{}'.format(val))
+
+        self.macro_expansion_dict = expansion_dict
+        self.macro_expansion_version = self.macro_dict.version
 
     def replace_macro(self, lines: str) -> str:
         """
         replace macros in C code with its definition and return the clear C code
         """
-        lines = re.sub(r'#define\s+.*\n', '', lines)
-        for macro, val in self.macro_dict.items():
-            lines = re.sub(r'\b{}\b'.format(macro), '{}'.format(val), lines)
+        if self.macro_expansion_version != self.macro_dict.version:
+            self.generate_macro_expansion_dict()
+        expansion_dict = self.macro_expansion_dict
 
-        return lines
+        def expand(m):
+            if m.group(1):      # #define clause
+                return ''
+            return expansion_dict.get(m.group(), m.group())
+
+        return c_define_or_identifier_pattern.sub(expand, lines)
+
+    def replace_macro_in_files(self):
+        """
+        Replace the macros in the header files and find the structures, unions, functions and function pointers declared
+        in the result. The result of a file is reused from cache if its key in check_macro() and the final macros, which
+        include the enum members, are not changed.
+        """
+        macro_state = self.hash_text(json.dumps(self.macro_dict))          # the order of macros matters in expansion
+        for i, lines in enumerate(self.intermediate_h_files):
+            key = self.hash_text(self.check_macro_key_list[i] + macro_state)
+            cache = self.get_cache('replaced', key)
+            if cache is None:
+                lines = self.replace_macro(lines)
+                cache = [lines, self.find_declarations(lines, replaced_declaration_pattern_dict)]
+            self.set_cache('replaced', key, cache)
+            self.intermediate_h_files[i] = cache[0]
+            self.declaration_list[i].update(cache[1])
 
 
 class TypeDefParser(PreProcessor):
@@ -585,37 +1443,62 @@ class TypeDefParser(PreProcessor):
         self.basic_type_dict.setdefault('bool', ttype)
         ttype = self._Type(name='unsigned', base_type='c_uint', is_ptr=False)
         self.basic_type_dict.setdefault('unsigned', ttype)
+        for name, ttype in self.basic_type_dict.items():
+            self.add_symbol(name, 'basic', ttype.base_type, ttype.is_ptr)
 
     def generate_typedef_mapping_dict(self):
         """
-        Generate basic type dict from header files
-        """
-        for lines in self.intermediate_h_files:
-            contents = re.findall(r'typedef\s+([\w\s*]+)\s+([*\w]+);', lines)
-            for content in contents:
-                original_type = content[0].strip()
-                customized_type = content[1]
-                ttype = self._Type(name=customized_type, base_type=original_type, is_ptr=False)
-                if '*' in original_type:
-                    original_type = original_type.strip('*')
-                    ttype.is_ptr = True
-                if '*' in customized_type:
-                    customized_type = customized_type.strip('*')
-                    ttype.is_ptr = True
+        Generate basic type dict from header files.
 
+        The typedefs of all header files are collected before any of them is resolved, so that a typedef may refer to a
+        type declared after it. Each chain of aliases is walked once, and all the aliases on it get the basic type or
+        structure at its end.
+        """
+        typedef_dict = dict()           # key = customized type, value = (original type, is_ptr)
+        for declarations in self.declaration_list:
+            for original_type, customized_type in declarations['typedefs']:
+                is_ptr = '*' in original_type or '*' in customized_type
+                typedef_dict[customized_type.strip('*')] = (' '.join(original_type.replace('*', ' ').split()), is_ptr)
+
+        resolved_dict = dict()          # key = customized type, value = (base type, is_ptr, kind), None if unresolved
+        for customized_type in typedef_dict:
+            chain = list()
+            chain_set = set()
+            name = customized_type
+            while True:
+                if name in resolved_dict:
+                    end = resolved_dict[name]
+                    break
+                if name not in typedef_dict or name in chain_set:           # basic C type, unknown type or loop
+                    ttype = self.basic_type_dict.get(name)
+                    end = (ttype.base_type, ttype.is_ptr, 'basic') if ttype else None
+                    break
+                chain.append(name)
+                chain_set.add(name)
+                original_type = typedef_dict[name][0]
                 if 'struct' in original_type or 'union' in original_type:
-                    original_type = re.sub(r'\bstruct\b', '', original_type)
-                    original_type = re.sub(r'\bunion\b', '', original_type)
-                    ttype.base_type = original_type.strip()
-                    self.struct_union_type_dict[customized_type] = ttype
-                elif original_type in self.basic_type_dict.keys():        # parse basic c types
-                    ttype.base_type = self.basic_type_dict[original_type].base_type
-                    ttype.is_ptr = ttype.is_ptr or self.basic_type_dict[original_type].is_ptr
-                    self.basic_type_dict[customized_type] = ttype
-                elif original_type in self.struct_union_type_dict.keys():         # parse struct/union typedef
-                    ttype.base_type = self.struct_union_type_dict[original_type].base_type
-                    ttype.is_ptr = ttype.is_ptr or self.struct_union_type_dict[original_type].is_ptr
-                    self.struct_union_type_dict[customized_type] = ttype
+                    original_type = re.sub(r'\b(struct|union)\b', '', original_type).strip()
+                    end = (original_type, False, 'struct_typedef')
+                    break
+                name = original_type
+            for name in reversed(chain):
+                if end is not None:
+                    end = (end[0], end[1] or typedef_dict[name][1], end[2])
+                resolved_dict[name] = end
+
+        self.count('typedefs', len(resolved_dict))
+        for customized_type, resolved in resolved_dict.items():
+            if resolved is None:
+                logging.warning(f'Unrecognized typedef! {typedef_dict[customized_type][0]} {customized_type}')
+                self.count('unresolved_typedefs')
+                continue
+            base_type, is_ptr, kind = resolved
+            ttype = self._Type(name=customized_type, base_type=base_type, is_ptr=is_ptr)
+            if kind == 'basic':
+                self.basic_type_dict[customized_type] = ttype
+            else:
+                self.struct_union_type_dict[customized_type] = ttype
+            self.add_symbol(customized_type, kind, base_type, is_ptr)
 
 
 class StructUnionParser(PreProcessor):
@@ -624,6 +1507,10 @@ class StructUnionParser(PreProcessor):
     """
     def __init__(self):
         super().__init__()
+        self.forward_struct_set = set()         # names of structures declared before their _fields_ are assigned
+        self.struct_class_dict = dict()         # key = name of structure, value = _Struct
+        self.struct_layout_dict = dict()        # key = name of structure, value = _Layout, see get_struct_layout()
+        self.struct_tag_dict = dict()           # key = tag of typedef structure, value = name of structure, e.g. _a: a
 
     class _Struct:
         """
@@ -636,10 +1523,20 @@ class StructUnionParser(PreProcessor):
             self.pointer_flags = list()                     # list of bool
             self.member_idc = list()                        # list of integer
             self.isUnion = False                            # structure = False, Union = True
+            self.header_file = None                         # name of header file without ".h"
 
         def __getitem__(self, item):
             return self.struct_members[item], self.struct_types[item], self.struct_types[item], self.member_idc[item]
 
+    class _Layout:
+        """
+        A class recording the size, alignment and offsets of members of a structure/union in bytes
+        """
+        def __init__(self, size: int, alignment: int, offsets: list):
+            self.size = size
+            self.alignment = alignment
+            self.offsets = offsets                          # list of integer, in the order of members
+
     def parse_struct_member_info(self, struct: _Struct, struct_infos: list):
         for struct_info in struct_infos:
             struct_info = struct_info.strip()  # This is necessary
@@ -653,9 +1550,8 @@ class StructUnionParser(PreProcessor):
                 idx = 1
                 for expr in expressions:
                     try:
-                        idx = idx * int(eval(expr))
-                    except Exception:
-                        traceback.print_exc()
+                        idx = idx * int(self.eval_c_expr(expr))
+                    except CExprError:
                         logging.error(f'Unrecognized macro: {expr}.. {struct.struct_name}')
                 if re.search(r'([*\w\s]+)\s+([*\w\s]+)\[([\s*/\-+\d()]+)?]', struct_info):  # support +-/*
                     member_type, member_name, _ = re.search(r'([*\w\s]+)\s+([*\w\s]+)\[([\s*/\-+\d()]+)?]', struct_info).groups()
@@ -672,9 +1568,8 @@ class StructUnionParser(PreProcessor):
                 else:
                     logging.error(f'Error parsing {struct.struct_name}')
                 try:
-                    idx = int(eval(idx))
-                except Exception:
-                    traceback.print_exc()
+                    idx = int(self.eval_c_expr(idx or ''))
+                except CExprError:
                     logging.error(f'Unrecognized macro: {idx}... {struct.struct_name}')
             else:
                 tmp = re.findall(r'([*\w\s]+)\s+([^;}]+)', struct_info)  # parse the members of structure
@@ -703,42 +1598,51 @@ class StructUnionParser(PreProcessor):
 
         self.struct_class_list.append(struct)
         self.struct_class_name_list.append(struct.struct_name)
+        self.struct_class_dict[struct.struct_name] = struct
+        self.add_symbol(struct.struct_name, 'struct')
 
     def generate_struct_union_class_list(self):
         """
         Parse header files and save structure/union into a list of class, which records their information
         """
-        for lines in self.intermediate_h_files:
-            structs = re.findall(r'typedef struct[\s\w]*{([^{}]+)}([\s\w,*]+);\s', lines)             # match: typedef struct _a{}a, *ap;
+        for declarations, h_file in zip(self.declaration_list, self.h_files):
+            header_file = os.path.basename(h_file)[:-2]
+            structs = declarations['typedef_structs']
             struct_flags = [False] * len(structs)
-            unions = re.findall(r'typedef union[\s\w]*{([^{}]+)}([\s\w,*]+);\s', lines)             # match: typedef union _a{}a, *ap;
+            unions = declarations['typedef_unions']
             union_flags = [True] * len(unions)
             contents = structs + unions
             flags = struct_flags + union_flags
             for content, flag in zip(contents, flags):
                 struct = self._Struct()
                 struct.isUnion = flag
-                struct_name = re.sub(r'\s', '', content[1])
+                struct.header_file = header_file
+                struct_name = re.sub(r'\s', '', content[2])
                 if re.search(r',\s*\*', struct_name):
                     struct_name, struct_pointer_name = re.search(r'(\w+),\s*\*(\w+)', struct_name).groups()
                     ttype = self._Type(name=struct_pointer_name, base_type=struct_name, is_ptr=True)
                     self.struct_union_type_dict[struct_pointer_name] = ttype            # store struct pointer
+                    self.add_symbol(struct_pointer_name, 'struct_typedef', struct_name, True)
                 struct.struct_name = struct_name
+                tag = content[0].split()
+                if tag and tag[-1] != struct_name:
+                    self.struct_tag_dict[tag[-1]] = struct_name
                 if self.exception_dict.__contains__(struct_name):
                     continue
                 else:
-                    struct_infos = content[0].split(';')
+                    struct_infos = content[1].split(';')
                     self.parse_struct_member_info(struct, struct_infos)
 
-            structs = re.findall(r'struct\s*([\w]+)\s*{([^}]+)?}\s*;', lines)  # match: struct _a{};
+            structs = declarations['structs']
             struct_flags = [False] * len(structs)
-            unions = re.findall(r'union\s*([\w]+)\s*{([^}]+)?}\s*;', lines)  # match: struct _a{};
+            unions = declarations['unions']
             union_flags = [True] * len(unions)
             contents = structs + unions
             flags = struct_flags + union_flags
             for content, flag in zip(contents, flags):
                 struct = self._Struct()
                 struct.isUnion = flag
+                struct.header_file = header_file
                 struct_name = re.sub(r'\s', '', content[0])
                 struct.struct_name = struct_name
                 if self.exception_dict.__contains__(struct_name):
@@ -747,40 +1651,87 @@ class StructUnionParser(PreProcessor):
                     struct_infos = content[1].split(';')
                     self.parse_struct_member_info(struct, struct_infos)
 
-    def sort_structs(self):
-        sorted_queue = deque()
+    def get_struct_dependencies(self, struct: _Struct, struct_dict: dict) -> list:
+        """
+        Return [(name of structure, is_pointer)] of the structures used by the members, in the order of members.
+        The structures in the parameters of a function pointer are regarded as pointers.
+        """
+        dependencies = list()
+        visited_func_ptr_set = set()
+
+        def add_func_ptr_dependencies(func_ptr: str):
+            visited_func_ptr_set.add(func_ptr)
+            for param in self.func_pointer_dict[func_ptr]:
+                for name in c_identifier_pattern.findall(param):
+                    if name in self.func_pointer_dict and name not in visited_func_ptr_set:
+                        add_func_ptr_dependencies(name)
+                    elif name in struct_dict:
+                        dependencies.append((name, True))
+
+        for struct_type, pointer_flag in zip(struct.struct_types, struct.pointer_flags):
+            if not pointer_flag and struct_type in struct_dict:
+                dependencies.append((struct_type, False))
+                continue
+            for name in c_identifier_pattern.findall(struct_type):
+                if name in self.func_pointer_dict and name not in visited_func_ptr_set:
+                    add_func_ptr_dependencies(name)
+                elif name in struct_dict:
+                    dependencies.append((name, True))
+        return dependencies
 
-        for item in self.struct_class_list:
-            sorted_queue = self.sort_structs_dfs(item, sorted_queue)
+    def sort_structs(self):
+        """
+        Sort the structures so that a structure is defined after the structures it uses, each structure is visited once.
+        The loops of pointers (strongly connected components) are found with the same Tarjan's algorithm as include
+        loops. In a loop, the structures are sorted by the members contained by value, and a structure whose pointer is
+        used before it is defined is declared first and gets its _fields_ later, see forward_struct_set.
+        """
+        struct_dict = dict()                    # key = name of structure, value = list of structures of that name
+        for struct in self.struct_class_list:
+            struct_dict.setdefault(struct.struct_name, list()).append(struct)
+
+        dependency_graph = dict()               # key = name of structure, value = dict of the structures it uses
+        contained_dict = dict()                 # key = name of structure, value = list of structures it contains
+        for name, structs in struct_dict.items():
+            dependencies = self.get_struct_dependencies(structs[0], struct_dict)
+            dependency_graph[name] = dict.fromkeys(dependent_name for dependent_name, _ in dependencies)
+            contained_dict[name] = [dependent_name for dependent_name, is_pointer in dependencies if not is_pointer]
+
+        sorted_names = list()
+        self.forward_struct_set = set()
+        for component in self.find_include_loops(dependency_graph):
+            if len(component) == 1 and component[0] not in dependency_graph[component[0]]:
+                sorted_names.append(component[0])
+                continue
 
-        sorted_queue = list(sorted_queue)
-        unique_queue = list(set(sorted_queue))
-        unique_queue.sort(key=sorted_queue.index)
-        self.struct_class_list = unique_queue
+            component_set = set(component)
+            component_names = list()
+            visiting_set = set()
+
+            def visit(struct_name: str):
+                visiting_set.add(struct_name)
+                for contained_name in contained_dict[struct_name]:
+                    if contained_name in visiting_set:
+                        logging.error(f'Structure {struct_name} contains {contained_name}, which contains itself')
+                    elif contained_name in component_set and contained_name not in component_names:
+                        visit(contained_name)
+                if struct_name not in component_names:
+                    component_names.append(struct_name)
+                visiting_set.discard(struct_name)
+
+            for name in component:
+                if name not in component_names:
+                    visit(name)
+            defined_set = set()
+            for name in component_names:
+                self.forward_struct_set.update(dependent_name for dependent_name in dependency_graph[name]
+                                               if dependent_name in component_set and dependent_name not in defined_set)
+                defined_set.add(name)
+            sorted_names.extend(component_names)
+
+        self.struct_class_list = [struct for name in sorted_names for struct in struct_dict[name]]
         self.struct_class_name_list = [struct.struct_name for struct in self.struct_class_list]
 
-    def sort_structs_dfs(self, item: _Struct, sorted_queue: deque):
-        sorted_queue.appendleft(item)
-        for struct_type in item.struct_types:
-            struct_type = re.sub(r'^POINTER\(', '', struct_type)  # Remove POINTER decoration, only keep the base type of structure member
-            struct_type = re.sub(r'\)$', '', struct_type)         # Remove POINTER decoration, only keep the base type of structure member
-            if struct_type in self.struct_class_name_list:
-                idx = self.struct_class_name_list.index(struct_type)
-                dependent_struct = self.struct_class_list[idx]
-                sorted_queue.appendleft(dependent_struct)
-                sorted_queue = self.sort_structs_dfs(dependent_struct, sorted_queue)
-            elif self.func_pointer_dict.__contains__(struct_type):
-                for param in self.func_pointer_dict[struct_type]:
-                    param = re.sub(r'^POINTER\(', '', param)  # Remove POINTER decoration
-                    param = re.sub(r'\)$', '', param)  # Remove POINTER decoration
-                    if param in self.struct_class_name_list:
-                        idx = self.struct_class_name_list.index(param)
-                        dependent_struct = self.struct_class_list[idx]
-                        sorted_queue.appendleft(dependent_struct)
-                        sorted_queue = self.sort_structs_dfs(dependent_struct, sorted_queue)
-
-        return sorted_queue
-
     def convert_structure_class_to_ctypes(self):
         """
         Convert customized type to ctypes here; convert C array to legal python ctypes here.
@@ -798,8 +1749,8 @@ class StructUnionParser(PreProcessor):
             for member, struct_type, pointer_flag in zip(struct.struct_members, struct.struct_types, struct.pointer_flags):
                 struct_type, pointer_flag = self.convert_to_ctypes(struct_type, pointer_flag)
 
-                if struct_type in self.enum_class_name_list:
-                    struct_type = 'c_long'
+                if self.get_symbol_kind(struct_type) == 'enum':
+                    struct_type = 'c_int'
 
                 updated_struct_members.append(member)
                 updated_struct_types.append(struct_type)
@@ -812,44 +1763,276 @@ class StructUnionParser(PreProcessor):
         # Sort the structure class
         self.sort_structs()
 
+    def get_type_layout(self, type_name: str, is_ptr: bool):
+        """
+        Return (size, alignment) of a member type, either a C type or the ctypes name it is converted to.
+        Return None if the size is unknown.
+        """
+        symbol = self.symbol_dict.get(type_name)
+        if symbol is not None and symbol.kind in ('basic', 'struct_typedef', 'exception'):
+            type_name, is_ptr = self.convert_to_ctypes(type_name, is_ptr)
+            symbol = self.symbol_dict.get(type_name)
+        kind = symbol.kind if symbol else None
+        ptr_size = 4 * self.PLATFORM_BIT_SCALER
+        if is_ptr or kind == 'func_ptr' or type_name in ('c_void_p', 'c_char_p', 'c_wchar_p'):
+            return ptr_size, ptr_size
+        if kind == 'struct':
+            layout = self.get_struct_layout(type_name)
+            return (layout.size, layout.alignment) if layout else None
+        if kind == 'enum':
+            type_name = 'c_int'                 # members of enumerate type are written as c_int
+        if self.PLATFORM_BIT_SCALER == 1:   # 32bit
+            size = self.sizeof_basic_c_type_dict_32bit.get(type_name)
+        else:   # 64 bit
+            size = self.sizeof_basic_c_type_dict_64bit.get(type_name)
+        if size is None:
+            return None
+        size = int(size)
+        return size, size & -size               # e.g. long double of 12 bytes is aligned to 4 bytes
+
+    def get_struct_layout(self, struct_name: str):
+        """
+        Return the _Layout of a structure/union with the rules of C compilers: every member is aligned to its size,
+        a structure is aligned to its largest member and padded to a multiple of its alignment.
+        Return None if the size of any member is unknown. The layouts are computed once and kept.
+        """
+        layout = self.struct_layout_dict.get(struct_name)
+        if layout is not None or struct_name not in self.struct_class_dict:
+            return layout
+        self.struct_layout_dict[struct_name] = None          # a structure containing itself has no layout
+        struct = self.struct_class_dict[struct_name]
+        offsets = list()
+        size = 0
+        alignment = 1
+        for member, struct_type, pointer_flag, idx in zip(struct.struct_members, struct.struct_types, struct.pointer_flags,
+                                                          struct.member_idc):
+            type_layout = self.get_type_layout(struct_type, pointer_flag)
+            if type_layout is None or not isinstance(idx, int):
+                logging.warning(f'Unknown size of member {member} in {struct_name}, its layout is skipped')
+                del self.struct_layout_dict[struct_name]
+                return None
+            member_size, member_alignment = type_layout
+            member_size *= idx or 1
+            alignment = max(alignment, member_alignment)
+            if struct.isUnion:
+                offsets.append(0)
+                size = max(size, member_size)
+            else:
+                offset = -(-size // member_alignment) * member_alignment
+                offsets.append(offset)
+                size = offset + member_size
+        size = -(-size // alignment) * alignment
+        layout = self._Layout(size, alignment, offsets)
+        self.struct_layout_dict[struct_name] = layout
+        return layout
+
+    def get_c_type_size(self, type_names: tuple, ptr_depth: int) -> int:
+        """
+        Get sizeof a type in C expression, including the structures and unions parsed so far
+        """
+        type_name = ' '.join(name for name in type_names if name not in ('struct', 'union'))
+        type_name = self.struct_tag_dict.get(type_name, type_name)
+        if not ptr_depth and self.get_symbol_kind(type_name) in ('struct', 'struct_typedef'):
+            type_layout = self.get_type_layout(type_name, False)
+            if type_layout is None:
+                raise CExprError(f'Unknown size of {" ".join(type_names)}')
+            return type_layout[0]
+        return super().get_c_type_size(type_names, ptr_depth)
+
+    def write_struct_layout_into_py(self):
+        """
+        generate struct_layout.py, the constant sizes, alignments and offsets of members of structures, so that the
+        members can be read from a raw buffer without creating the ctypes objects
+        """
+        with open_output_file(os.path.join('output', 'struct_layout.py'), self.env.get('compile_output', True)) as fp:
+            fp.write('"""\n')
+            fp.write('    @usage: Layout of Structure and Union type in bytes\n')
+            fp.write('"""\n')
+            fp.write(f'POINTER_SIZE = {4 * self.PLATFORM_BIT_SCALER}\n\n')
+            sizeof_lines = list()
+            alignof_lines = list()
+            offsetof_lines = list()
+            for struct in self.struct_class_list:
+                layout = self.get_struct_layout(struct.struct_name)
+                if layout is None:
+                    continue
+                sizeof_lines.append(f'    {struct.struct_name!r}: {layout.size},\n')
+                alignof_lines.append(f'    {struct.struct_name!r}: {layout.alignment},\n')
+                offsets = ', '.join(f'{member!r}: {offset}' for member, offset in zip(struct.struct_members, layout.offsets))
+                offsetof_lines.append(f'    {struct.struct_name!r}: {{{offsets}}},\n')
+            for name, lines in (('SIZEOF', sizeof_lines), ('ALIGNOF', alignof_lines), ('OFFSETOF', offsetof_lines)):
+                fp.write(f'{name} = {{\n')
+                fp.writelines(lines)
+                fp.write('}\n\n')
+
+    def check_struct_layouts(self):
+        """
+        Compare the layouts in struct_layout.py, and the itemsize of the dtypes in numpy_dtypes.py if it is written,
+        with ctypes.sizeof() and the offsets of the classes in structure_class.py, and log the structures that differ.
+        ctypes follows the ABI of the running python, so the layouts are only checked when target_abi is the same.
+        """
+        if self.target_abi != host_abi:
+            return
+        try:
+            class_dict = runpy.run_path(os.path.join('output', 'structure_class.py'))
+        except Exception as e:
+            logging.error(f'Unable to load structure_class.py to check the layouts: {e!r}')
+            return
+        dtype_dict = dict()
+        if self.env.get('numpy_dtypes', False):
+            try:
+                dtype_dict = runpy.run_path(os.path.join('output', 'numpy_dtypes.py'))
+            except ImportError:
+                pass                # NumPy is not installed
+            except Exception as e:
+                logging.error(f'Unable to load numpy_dtypes.py to check the itemsizes: {e!r}')
+        for struct in self.struct_class_list:
+            layout = self.get_struct_layout(struct.struct_name)
+            struct_class = class_dict.get(struct.struct_name)
+            if layout is None or struct_class is None:
+                continue
+            offsets = [getattr(getattr(struct_class, member, None), 'offset', None) for member in struct.struct_members]
+            if ctypes.sizeof(struct_class) != layout.size or offsets != layout.offsets:
+                logging.error(f'Layout of {struct.struct_name} differs from ctypes: size {layout.size} offsets '
+                              f'{layout.offsets}, ctypes size {ctypes.sizeof(struct_class)} offsets {offsets}')
+            dtype = dtype_dict.get(struct.struct_name)
+            if dtype is not None and dtype.itemsize != ctypes.sizeof(struct_class):
+                logging.error(f'Itemsize of dtype {struct.struct_name} is {dtype.itemsize}, '
+                              f'ctypes size is {ctypes.sizeof(struct_class)}')
+
+    def get_numpy_format(self, type_name: str, is_ptr: bool, idx) -> str:
+        """
+        Return the source of the NumPy format of a member, e.g. 'u4', ('f8', (3,)), DEV for the dtype of structure DEV.
+        Return None if the size is unknown.
+        """
+        type_layout = self.get_type_layout(type_name, is_ptr)
+        if type_layout is None:
+            return None
+        size = type_layout[0]
+        kind = self.get_symbol_kind(type_name)
+        if is_ptr or kind == 'func_ptr' or type_name in ('c_void_p', 'c_char_p', 'c_wchar_p'):
+            numpy_format = repr(f'u{size}')             # address of pointer
+        elif kind == 'struct':
+            numpy_format = type_name
+        elif type_name == 'c_char':
+            return repr(f'S{idx or 1}')                 # char array is read as bytes
+        elif type_name == 'c_bool':
+            numpy_format = repr('?')
+        elif type_name in ('c_float', 'c_double', 'c_longdouble'):
+            numpy_format = repr(f'f{size}')             # long double of 12/16 bytes is f12/f16 where numpy has it
+        else:
+            numpy_format = repr(f'{"u" if type_name in self.unsigned_ctypes_lib_vars else "i"}{size}')
+        if idx:
+            return f'({numpy_format}, ({idx},))'
+        return numpy_format
+
+    def get_numpy_dtype(self, struct: _Struct) -> str:
+        """
+        Return the source of the NumPy structured dtype of structure/union, with the offsets and itemsize of its layout.
+        Return None if its layout is unknown.
+        """
+        layout = self.get_struct_layout(struct.struct_name)
+        if layout is None:
+            return None
+        formats = list()
+        for struct_type, pointer_flag, idx in zip(struct.struct_types, struct.pointer_flags, struct.member_idc):
+            numpy_format = self.get_numpy_format(struct_type, pointer_flag, idx)
+            if numpy_format is None:
+                return None
+            formats.append(numpy_format)
+        indent = ' ' * (len(struct.struct_name) + 13)
+        return (f"{struct.struct_name} = np.dtype({{'names': {struct.struct_members!r},\n"
+                f"{indent}'formats': [{', '.join(formats)}],\n"
+                f"{indent}'offsets': {layout.offsets!r},\n"
+                f"{indent}'itemsize': {layout.size}}})\n")
+
+    def write_numpy_dtypes_into_py(self):
+        """
+        generate numpy_dtypes.py, the NumPy structured dtypes of structures, so that an array of structures returned
+        by the dll can be viewed with numpy.frombuffer() without copying
+        """
+        with open_output_file(os.path.join('output', 'numpy_dtypes.py'), self.env.get('compile_output', True)) as fp:
+            fp.write('"""\n')
+            fp.write('    @usage: NumPy structured dtype of Structure and Union type, e.g. numpy.frombuffer(buffer, dtype=DEV)\n')
+            fp.write('"""\n')
+            fp.write('import numpy as np\n\n\n')
+            for struct in self.struct_class_list:
+                numpy_dtype = self.get_numpy_dtype(struct)
+                if numpy_dtype is None:
+                    fp.write(f'# {struct.struct_name} is skipped, its layout is unknown\n\n')
+                    continue
+                fp.write(numpy_dtype)
+                fp.write('\n')
+
+    def get_struct_class(self, struct: _Struct) -> str:
+        """
+        Return the source of the class of structure/union
+        """
+        if struct.struct_name in self.forward_struct_set:
+            fields = self.get_struct_fields(struct, ' ' * (len(struct.struct_name) + 13))
+            return f'{struct.struct_name}._fields_ = [{fields}]\n'
+        fields = self.get_struct_fields(struct, ' ' * 16)
+        return f'class {struct.struct_name}({"Union" if struct.isUnion else "Structure"}):\n    _fields_ = [{fields}]\n'
+
+    def get_struct_fields(self, struct: _Struct, indent: str) -> str:
+        info_list = []
+        for member, struct_type, pointer_flag, idx in zip(struct.struct_members, struct.struct_types, struct.pointer_flags, struct.member_idc):
+            # check void
+            if pointer_flag:
+                struct_type = f'POINTER({struct_type})'
+            if idx:
+                info = '("' + f'{member}' + '", ' + f'{struct_type} * {idx}' + ')'
+            else:
+                info = '("' + f'{member}' + '", ' + f'{struct_type}' + ')'
+            info_list.append(info)
+        return f',\n{indent}'.join(info_list)
+
+    def get_func_ptr_type(self, name: str) -> str:
+        """
+        Return the source of the type of function pointer. Each type is defined once and referred by its name in
+        structures and wrappers, so that it is not built again on every use.
+        """
+        return f'{name} = CFUNCTYPE({", ".join(self.func_pointer_dict[name])})\n'
+
+    def iter_struct_and_func_ptr_types(self):
+        """
+        Yield (name, header file, source, types it depends on) of the structures and types of function pointer in the
+        order of definition: a type of function pointer goes right before the first structure using it, and the rest
+        of them go after all the structures.
+        """
+        defined_set = set()
+        for struct in self.struct_class_list:
+            if struct.struct_name in self.forward_struct_set and struct.struct_name not in defined_set:
+                defined_set.add(struct.struct_name)
+                yield (struct.struct_name, struct.header_file,
+                       f'class {struct.struct_name}({"Union" if struct.isUnion else "Structure"}):\n    pass\n', '')
+
+        def iter_func_ptr_types(type_names: list):
+            for type_name in type_names:
+                for name in c_identifier_pattern.findall(type_name):
+                    if name in self.func_pointer_dict and name not in defined_set:
+                        defined_set.add(name)
+                        yield from iter_func_ptr_types(self.func_pointer_dict[name])
+                        yield (name, self.func_pointer_header_dict.get(name), self.get_func_ptr_type(name),
+                               ' '.join(self.func_pointer_dict[name]))
+
+        for struct in self.struct_class_list:
+            yield from iter_func_ptr_types(struct.struct_types)
+            yield struct.struct_name, struct.header_file, self.get_struct_class(struct), ' '.join(struct.struct_types)
+        yield from iter_func_ptr_types(list(self.func_pointer_dict))
+
     def write_structure_class_into_py(self):
         """
         generate struct_class.py
         """
-        with open(os.path.join('output', 'structure_class.py'), 'w') as fp:
+        with open_output_file(os.path.join('output', 'structure_class.py'), self.env.get('compile_output', True)) as fp:
             fp.write('"""\n')
             fp.write('    @usage: Conversion result of Structure and Union type\n')
             fp.write('"""\n')
             fp.write('from ctypes import *\n\n\n')
-            for struct in self.struct_class_list:
-                if struct.isUnion:
-                    fp.write(f'class {struct.struct_name}(Union):\n    _fields_ = [')
-                    info_list = []
-                    for member, struct_type, pointer_flag, idx in zip(struct.struct_members, struct.struct_types, struct.pointer_flags, struct.member_idc):
-                        # check void
-                        if pointer_flag:
-                            struct_type = f'POINTER({struct_type})'
-                        if idx:
-                            info = '("' + f'{member}' + '", ' + f'{struct_type} * {idx}' + ')'
-                        else:
-                            info = '("' + f'{member}' + '", ' + f'{struct_type}' + ')'
-                        info_list.append(info)
-                    info_list = ',\n                '.join(info_list)
-                    fp.write(f'{info_list}]\n\n\n')
-                else:
-                    fp.write(f'class {struct.struct_name}(Structure):\n    _fields_ = [')
-                    info_list = []
-                    for member, struct_type, pointer_flag, idx in zip(struct.struct_members, struct.struct_types, struct.pointer_flags, struct.member_idc):
-                        # check void
-                        if pointer_flag:
-                            struct_type = f'POINTER({struct_type})'
-                        if idx:
-                            info = '("' + f'{member}' + '", ' + f'{struct_type} * {idx}' + ')'
-                        else:
-                            info = '("' + f'{member}' + '", ' + f'{struct_type}' + ')'
-                        info_list.append(info)
-                    info_list = ',\n                '.join(info_list)
-                    fp.write(f'{info_list}]\n\n\n')
+            for _, _, source, _ in self.iter_struct_and_func_ptr_types():
+                fp.write(source)
+                fp.write('\n\n')
 
 
 class EnumParser(PreProcessor):
@@ -867,13 +2050,15 @@ class EnumParser(PreProcessor):
             self.enum_name = None
             self.enum_members = list()              # list of string
             self.enum_values = list()               # list of integer
+            self.header_file = None                 # name of header file without ".h"
 
         def __getitem__(self, item):
             return self.enum_members[item], self.enum_values[item]
 
-    def parse_enum(self, enum_name: str, enum_infos: str):
+    def parse_enum(self, enum_name: str, enum_infos: str, header_file=None):
         enum = self._Enum()
         enum.enum_name = enum_name
+        enum.header_file = header_file
 
         enum_infos = enum_infos.split(',')
         enum_infos = list(filter(None, enum_infos))
@@ -884,30 +2069,11 @@ class EnumParser(PreProcessor):
                 enum_value = enum_info.split('=')[1]
 
                 try:
-                    value = eval(enum_value)
-                    if isinstance(value, int) or isinstance(value, float):
-                        enum_value = value
-                        default_value = enum_value
-                    else:
-                        logging.warning(f"Unable to parse enum {enum_member}\n")
-                        return None
-                except Exception:
-                    for m, v in self.macro_dict.items():
-                        enum_value = re.sub(r'\b{}\b'.format(m), '{}'.format(v), enum_value)
-                    enum_value = re.sub(r'\b(\d+)[uUlL]+\b', r'\1', enum_value)
-                    enum_value = re.sub(r'\b(0x[\da-fA-F]+)[uUlL]+\b', r'\1', enum_value)
-                    try:
-                        value = eval(enum_value)
-                        if isinstance(value, int) or isinstance(value, float):
-                            enum_value = value
-                            default_value = enum_value
-                        else:
-                            logging.warning(f"Unable to parse enum {enum_member}\n")
-                            return None
-                    except Exception:
-                        traceback.print_exc()
-                        logging.error(f"Error in parsing enum {enum_member}\n")
-                        continue
+                    enum_value = self.eval_c_expr(enum_value)
+                    default_value = enum_value
+                except CExprError:
+                    logging.error(f"Error in parsing enum {enum_member}\n")
+                    continue
             else:
                 enum_member = enum_info
                 enum_value = default_value
@@ -919,39 +2085,47 @@ class EnumParser(PreProcessor):
 
         self.enum_class_list.append(enum)
         self.enum_class_name_list.append(enum.enum_name)
+        self.add_symbol(enum.enum_name, 'enum')
 
     def generate_enum_class_list(self):
         """
         Parse header files and get enumerate types. Store their information in enum_class
         """
-        for lines in self.intermediate_h_files:
-            contents = re.findall(r'typedef enum[^;]+;', lines)  # find all enumerate types
+        for declarations, h_file in zip(self.declaration_list, self.h_files):
+            header_file = os.path.basename(h_file)[:-2]
+            contents = declarations['typedef_enums']  # find all enumerate types
             for content in contents:
                 tmp = re.split(r'[{}]', content)  # split the typedef enum{ *** } name;
                 enum_infos = re.sub(r'\s', '', tmp[1])
                 enum_name = re.sub(r'[\s;]', '', tmp[2])
-                self.parse_enum(enum_name, enum_infos)
+                self.parse_enum(enum_name, enum_infos, header_file)
 
-            contents = re.findall(r'enum\s+(\w+)\s*{([^{}]+)};', lines)  # parse another way to define a enum type
+            contents = declarations['enums']  # parse another way to define a enum type
             for content in contents:
                 enum_name = content[0]
                 enum_infos = re.sub(r'\s', '', content[1])
-                self.parse_enum(enum_name, enum_infos)
+                self.parse_enum(enum_name, enum_infos, header_file)
+
+    def get_enum_class(self, enum: _Enum) -> str:
+        """
+        Return the source of the class of enumerate type
+        """
+        lines = [f'@unique\nclass {enum.enum_name}(IntEnum):\n']
+        for member, val in enum:
+            lines.append(f'    {member} = {val}\n')
+        return ''.join(lines)
 
     def write_enum_class_into_py(self):
         """
         generate struct_class.py
         """
-        with open(os.path.join('output', 'enum_class.py'), 'w') as f:
+        with open_output_file(os.path.join('output', 'enum_class.py'), self.env.get('compile_output', True)) as f:
             f.write('"""\n')
             f.write('    @usage: Conversion result of Enumeration type\n')
             f.write('"""\n')
             f.write('from enum import Enum, unique, IntEnum\n\n\n')
             for enum in self.enum_class_list:
-                # f.write(f'class {enum.enum_name}(IntEnum):\n')
-                f.write(f'@unique\nclass {enum.enum_name}(IntEnum):\n')
-                for member, val in enum:
-                    f.write(f'    {member} = {val}\n')
+                f.write(self.get_enum_class(enum))
                 f.write('\n\n')
 
 
@@ -999,12 +2173,7 @@ class FunctionParser(PreProcessor):
                 # Parameter has two forms: (1) int func(void, int); (2) int func(void a, int b);
                 # The if clause below checks these two forms and makes them a united format.
                 param_info_clean = re.sub(r'[\[*\]]', '', param_info.strip())
-                if self.exception_dict.__contains__(param_info_clean) \
-                    or self.basic_type_dict.__contains__(param_info_clean) \
-                    or param_info_clean in self.enum_class_name_list \
-                    or param_info_clean in self.struct_class_name_list \
-                    or self.struct_union_type_dict.__contains__(param_info_clean) \
-                    or self.func_pointer_dict.__contains__(param_info_clean):
+                if param_info_clean in self.symbol_dict:
                     param_info = (param_info, f'arg{i}')
                 else:
                     param_info = re.search(r'([*\w\s]+)\s+([\[\]*\w]+)', param_info).groups()
@@ -1020,12 +2189,9 @@ class FunctionParser(PreProcessor):
         get all the functions to be wrapped.
         save those function information(name, argument type, return type) in func_list
         """
-        for lines, h_file in zip(self.intermediate_h_files, self.h_files):
-            # This pattern matching rule may have bugs in other cases
-            # Another way is to use [^;] to replace .*?
-            lines = re.findall(r'__declspec\(dllexport\)\s+([*\w]+)\s+(\w+)\s*\((.*?)\)\s*;', lines, re.S)  # find all exported functions
-            # For each function
-            for content in lines:
+        for declarations, h_file in zip(self.declaration_list, self.h_files):
+            # For each exported function
+            for content in declarations['funcs']:
                 if content[1] not in self.func_name_list:
                     self.func_name_list.append(content[1])
                 else:
@@ -1034,7 +2200,7 @@ class FunctionParser(PreProcessor):
                 ret_type = content[0]
                 func.func_name = content[1]
                 func.ret_type, ret_ptr_flag = self.convert_to_ctypes(ret_type, False)           # Ignore the case that return value is a pointer
-                if func.ret_type in self.enum_class_name_list:
+                if self.get_symbol_kind(func.ret_type) == 'enum':
                     func.ret_type = 'c_int'
 
                 # parse parameters
@@ -1052,84 +2218,224 @@ class FunctionParser(PreProcessor):
                 func.header_file = os.path.basename(h_file)[:-2]
                 self.func_list.append(func)
 
+    def get_func_wrapper(self, func) -> tuple:
+        """
+        Return the argtypes of the function and the source of its wrapper, which calls the bound function _c_<name>
+        """
+        arg_names = func.get_arg_names()
+        lines = [f'def {func.func_name}({arg_names}):\n']
+
+        # Comment of this function
+        lines.append('    """\n')
+        arg_types = list()
+        call_args = list()          # a writable buffer is accepted for a pointer of basic type, see get_buffer_arg_func()
+        for param in func.parameters:
+            arg_type = param.arg_type
+            arg_name = param.arg_name
+            call_args.append(f'{arg_name}_p' if param.arg_pointer_flag else arg_name)
+            arg_kind = self.get_symbol_kind(arg_type)
+            if arg_kind == 'enum':              # convert customized variable type to C type
+                if param.arg_pointer_flag:
+                    arg_types.append('POINTER(c_int)')
+                    lines.append(f'    :param {arg_name}_p: A pointer of the enumerate class {arg_type}\n')
+                    call_args[-1] = f'_buffer_arg({arg_name}_p, c_int)'
+                else:
+                    arg_types.append('c_int')
+                    lines.append(f'    :param {arg_name}: member from enumerate class {arg_type}\n')
+            elif arg_kind == 'struct':
+                if param.arg_pointer_flag:
+                    arg_types.append(f'POINTER({arg_type})')
+                    lines.append(f'    :param {arg_name}_p: A pointer of the structure class {arg_type}\n')
+                else:
+                    arg_types.append(arg_type)
+                    lines.append(f'    :param {arg_name}: implementation of the structure class {arg_type}\n')
+            elif arg_kind == 'func_ptr':
+                arg_types.append(arg_type)
+                lines.append(f'    :param {arg_name}: a function pointer\n')
+            elif arg_kind == 'exception':
+                arg_types.append(self.exception_dict[arg_type])
+                lines.append(f'    :param {arg_name}: argument type {self.exception_dict[arg_type]}\n')
+            else:
+                if param.arg_pointer_flag and arg_type != 'c_void_p':
+                    arg_types.append(f'POINTER({arg_type})')
+                    lines.append(f'    :param {arg_name}_p: A pointer of {arg_type}\n')
+                    if arg_type in self.basic_ctypes_lib_vars:
+                        call_args[-1] = f'_buffer_arg({arg_name}_p, {arg_type})'
+                else:
+                    arg_types.append(arg_type)
+                    lines.append(f'    :param {arg_name}: argument type {arg_type}\n')
+                    if arg_type == 'c_void_p':
+                        call_args[-1] = f'_buffer_arg({call_args[-1]}, c_char)'
+        lines.append('    """\n')
+        lines.append(f'    ret = _c_{func.func_name}({", ".join(call_args)})\n')
+        lines.append(f'    return ret\n')
+        return f'[{", ".join(arg_types)}]', ''.join(lines)
+
+    def get_lib_loader(self) -> str:
+        """
+        Return the source of _get_lib(), which loads the library on first call
+        """
+        lines = ['_lib = None\n\n\n']
+        lines.append('def _get_lib():\n')
+        lines.append('    global _lib\n')
+        lines.append('    if _lib is None:\n')
+        lines.append(f'        _lib = CDLL(os.path.join(os.getcwd(), "{self.dll_path}"))\n')
+        lines.append('    return _lib\n')
+        return ''.join(lines)
+
+    def get_bind_func(self, is_lazy: bool) -> str:
+        """
+        Return the source of _bind(), which looks up a function in the library and sets its prototype
+        """
+        lines = ['def _bind(name, argtypes, restype):\n']
+        lines.append('    """\n')
+        if is_lazy:
+            lines.append('    Look up the function in the library and set its prototype once when it is used first\n')
+        else:
+            lines.append('    Look up the function in the library and set its prototype once when this module is imported\n')
+        lines.append('    """\n')
+        lines.append('    try:\n')
+        lines.append(f'        func = {"_get_lib()" if is_lazy else self.dll_name}[name]\n')
+        lines.append('    except AttributeError as e:         # not exported by the library, raise the error when it is called\n')
+        lines.append('        error = e\n\n')
+        lines.append('        def func(*args):\n')
+        lines.append('            raise error\n')
+        lines.append('        return func\n')
+        lines.append('    func.argtypes = argtypes\n')
+        lines.append('    func.restype = restype\n')
+        lines.append('    return func\n')
+        return ''.join(lines)
+
+    def get_buffer_arg_func(self) -> str:
+        """
+        Return the source of _buffer_arg(), which passes a writable buffer as a pointer of basic type without copying
+        """
+        lines = ['# Arguments passed to ctypes as they are: the objects converted by ctypes itself and every ctypes instance, whose\n']
+        lines.append('# base class _CData is not exported. The others of pointers of basic types are regarded as buffers.\n')
+        lines.append('_direct_arg_types = (int, bytes, str, type(None), type(ctypes.byref(ctypes.c_char())), ctypes._SimpleCData.__base__)\n')
+        lines.append("_float_formats = 'efdg'\n\n\n")
+        lines.append('def _buffer_arg(obj, ctype):\n')
+        lines.append('    """\n')
+        lines.append('    Pass a writable buffer, e.g. bytearray, memoryview, array.array and numpy.ndarray, as a pointer of ctype\n')
+        lines.append('    without copying. Its items must have the size of ctype and be floating point only for float types, else\n')
+        lines.append('    TypeError is raised. A buffer of bytes is passed as raw memory, so is any buffer for char * and void *.\n')
+        lines.append('    from_buffer() then checks that the buffer is writable, contiguous and holds at least one ctype.\n')
+        lines.append('    """\n')
+        lines.append('    if isinstance(obj, _direct_arg_types):\n')
+        lines.append('        return obj\n')
+        lines.append('    with memoryview(obj) as view:\n')
+        lines.append('        item_format = view.format[-1:]\n')
+        lines.append("        if ctype is not ctypes.c_char and not (view.itemsize == 1 and item_format in 'Bbc') and (\n")
+        lines.append('                view.itemsize != ctypes.sizeof(ctype) or\n')
+        lines.append('                (item_format in _float_formats) != (ctype._type_ in _float_formats)):\n')
+        lines.append("            raise TypeError(f'Buffer of {view.format!r} items of {view.itemsize} bytes is not an array of '\n")
+        lines.append("                            f'{ctype.__name__}')\n")
+        lines.append('    return ctypes.byref(ctype.from_buffer(obj))\n')
+        return ''.join(lines)
+
     def write_funcs_to_wrapper(self):
         """
         Generate main.py
+        Set "lazy_api" to true in config to load the library and bind each function on first use, the import time of
+        the wrapper is then nearly constant no matter how many APIs there are.
         """
+        is_lazy = self.env.get('lazy_api', False)
         wrapper_name = os.path.join('output', self.wrapper)
-        with open(wrapper_name, 'w') as fp:
+        with open_output_file(wrapper_name, self.env.get('compile_output', True)) as fp:
             fp.write('"""\n')
-            fp.write('    @usage: Conversion result of API\n')
+            if is_lazy:
+                fp.write('    @usage: Conversion result of API, the library is loaded and each function is bound on first use\n')
+            else:
+                fp.write('    @usage: Conversion result of API\n')
             fp.write('"""\n')
-            fp.write('import os\nfrom output.structure_class import *\n\n')
-            fp.write(f'{self.dll_name} = CDLL(os.path.join(os.getcwd(), "{self.dll_path}"))\n\n\n')
+            fp.write('import os\nimport ctypes\nfrom output.structure_class import *\n\n')
+            if is_lazy:
+                fp.write(self.get_lib_loader())
+                fp.write('\n\n')
+            else:
+                fp.write(f'{self.dll_name} = CDLL(os.path.join(os.getcwd(), "{self.dll_path}"))\n\n\n')
+            fp.write(self.get_bind_func(is_lazy))
+            fp.write('\n\n')
+            fp.write(self.get_buffer_arg_func())
+            fp.write('\n\n')
 
-        for func in self.func_list:
-            with open(wrapper_name, 'a') as fp:
-                arg_names = func.get_arg_names()
-                fp.write(f'def {func.func_name}({arg_names}):\n')
+            if is_lazy:
+                self.write_lazy_funcs(fp)
+                return
 
-                # Comment of this function
-                fp.write('    """\n')
-                arg_types = list()
-                for param in func.parameters:
-                    arg_type = param.arg_type
-                    arg_name = param.arg_name
-                    if arg_type in self.enum_class_name_list:              # convert customized variable type to C type
-                        if param.arg_pointer_flag:
-                            arg_types.append('POINTER(c_int)')
-                            fp.write(f'    :param {arg_name}_p: A pointer of the enumerate class {arg_type}\n')
-                        else:
-                            arg_types.append('c_int')
-                            fp.write(f'    :param {arg_name}: member from enumerate class {arg_type}\n')
-                    elif arg_type in self.struct_class_name_list:
-                        if param.arg_pointer_flag:
-                            arg_types.append(f'POINTER({arg_type})')
-                            fp.write(f'    :param {arg_name}_p: A pointer of the structure class {arg_type}\n')
-                        else:
-                            arg_types.append(arg_type)
-                            fp.write(f'    :param {arg_name}: implementation of the structure class {arg_type}\n')
-                    elif 'CFUNCTYPE' in arg_type:
-                        arg_types.append(arg_type)
-                        fp.write(f'    :param {arg_name}: a function pointer\n')
-                    elif self.exception_dict.__contains__(arg_type):
-                        arg_types.append(self.exception_dict[arg_type])
-                        fp.write(f'    :param {arg_name}: argument type {self.exception_dict[arg_type]}\n')
-                    else:
-                        if param.arg_pointer_flag and arg_type != 'c_void_p':
-                            arg_types.append(f'POINTER({arg_type})')
-                            fp.write(f'    :param {arg_name}_p: A pointer of {arg_type}\n')
-                        else:
-                            arg_types.append(arg_type)
-                            fp.write(f'    :param {arg_name}: argument type {arg_type}\n')
-                fp.write('    """\n')
-
-                fp.write(f'    func = {self.dll_name}["{func.func_name}"]\n')
-                arg_types = ', '.join(arg_types)
-                fp.write(f'    func.argtypes = [{arg_types}]\n')
-                fp.write(f'    func.restype = {func.ret_type}\n')
-                fp.write(f'    ret = func({arg_names})\n')
-                fp.write(f'    return ret\n\n\n')
-
-    def write_testcase_header(self):
-        with open(self.testcase, 'w') as fp:
-            fp.write('"""\n')
-            fp.write('    @usage: testcase template\n')
-            fp.write('"""\n')
-            fp.write('import os\nimport logging\nimport time\nimport traceback\n')
-            fp.write('from output.enum_class import *\n')
-            fp.write('from output.structure_class import *\n')
-            fp.write(f'from output.{self.wrapper[:-3]} import *\n')
-            fp.write('\n')
-            fp.write('if __name__ == "__main__":\n')
+            for func in self.func_list:
+                # The function is bound once at module level, the wrapper only calls it
+                arg_types, wrapper = self.get_func_wrapper(func)
+                fp.write(f'_c_{func.func_name} = _bind("{func.func_name}", {arg_types}, {func.ret_type})\n\n\n')
+                fp.write(wrapper)
+                fp.write('\n\n')
+
+    def write_lazy_funcs(self, fp):
+        """
+        Write the prototypes and the sources of wrappers as constants, they are evaluated by the module level
+        __getattr__ when a function is used first. A function imported by "import *" is a _LazyFunc, which defines
+        the wrapper on first call.
+        """
+        fp.write('# key = name of function, value = (argtypes, restype, source of wrapper)\n')
+        fp.write('_func_dict = {\n')
+        for func in self.func_list:
+            arg_types, wrapper = self.get_func_wrapper(func)
+            fp.write(f'    {func.func_name!r}: ({arg_types!r}, {func.ret_type!r},\n')
+            fp.write(f'        {wrapper!r}),\n')
+        fp.write('}\n\n\n')
+
+        fp.write('def _define(name):\n')
+        fp.write('    """\n')
+        fp.write('    Bind the function and define its wrapper in this module\n')
+        fp.write('    """\n')
+        fp.write('    arg_types, ret_type, wrapper = _func_dict[name]\n')
+        fp.write('    scope = globals()\n')
+        fp.write('    scope["_c_" + name] = _bind(name, eval(arg_types, scope), eval(ret_type, scope))\n')
+        fp.write('    exec(wrapper, scope)\n')
+        fp.write('    return scope[name]\n\n\n')
+
+        fp.write('class _LazyFunc:\n')
+        fp.write('    def __init__(self, name):\n')
+        fp.write('        self.__name__ = name\n')
+        fp.write('        self.func = None\n\n')
+        fp.write('    def __call__(self, *args, **kwargs):\n')
+        fp.write('        if self.func is None:\n')
+        fp.write('            self.func = globals()[self.__name__]\n')
+        fp.write('            if self.func is self:\n')
+        fp.write('                self.func = _define(self.__name__)\n')
+        fp.write('        return self.func(*args, **kwargs)\n\n\n')
+
+        fp.write('def __getattr__(name):\n')
+        fp.write(f'    if name == "{self.dll_name}":\n')
+        fp.write('        return _get_lib()\n')
+        fp.write('    if name not in _func_dict:\n')
+        fp.write('        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")\n')
+        fp.write('    func = globals()[name] = _LazyFunc(name)\n')
+        fp.write('    return func\n\n\n')
+
+        fp.write('def __dir__():\n')
+        fp.write('    return sorted(set(globals()) | set(_func_dict))\n\n\n')
+
+        fp.write('__all__ = [name for name in globals() if not name.startswith("_")] + list(_func_dict)\n')
+
+    def write_testcase_header(self, fp):
+        fp.write('"""\n')
+        fp.write('    @usage: testcase template\n')
+        fp.write('"""\n')
+        fp.write('import os\nimport logging\nimport time\nimport traceback\n')
+        fp.write('from output.enum_class import *\n')
+        fp.write('from output.structure_class import *\n')
+        fp.write(f'from output.{self.wrapper[:-3]} import *\n')
+        fp.write('\n')
+        fp.write('if __name__ == "__main__":\n')
 
     def write_testcase(self):
         """
         Automatically generate testcases. Since the initial value is usually set at practice. This part is just a draft.
         """
-        self.write_testcase_header()
-
-        with open(self.testcase, 'a') as fp:
+        struct_dict = {struct.struct_name: struct for struct in self.struct_class_list}
+        with open_output_file(self.testcase, compile_py=False) as fp:
+            self.write_testcase_header(fp)
             for func in self.func_list:
                 arg_names = list()
                 logging_infos = list()
@@ -1137,6 +2443,7 @@ class FunctionParser(PreProcessor):
                 for param in func.parameters:
                     arg_type = param.arg_type
                     arg_name = param.arg_name
+                    arg_kind = self.get_symbol_kind(arg_type)
                     # common param
                     if arg_type == 'c_void_p':
                         pass
@@ -1148,7 +2455,7 @@ class FunctionParser(PreProcessor):
                             arg_name = arg_name + '_p'
                         else:
                             logging_infos.append(f'    logging.debug(f"{arg_name}' + ' = {' + f'{arg_name}' + '}")\n')
-                    elif arg_type in self.enum_class_name_list:
+                    elif arg_kind == 'enum':
                         member_names = eval(arg_type).__dict__['_member_names_']
                         init_param_infos.append(f'    {arg_name} = {arg_type}.{member_names[0]}.value\n')  # maybe we could iterate
                         if param.arg_pointer_flag:
@@ -1157,11 +2464,9 @@ class FunctionParser(PreProcessor):
                             arg_name = arg_name + '_p'
                         else:
                             logging_infos.append(f'    logging.debug(f"{arg_name}' + ' = {' + f'{arg_name}' + '}")\n')
-                    elif arg_type in self.struct_class_name_list:
+                    elif arg_kind == 'struct':
                         attr_inits = []
-                        for struct_tmp in self.struct_class_list:
-                            if arg_type == struct_tmp.struct_name:
-                                struct = struct_tmp
+                        struct = struct_dict[arg_type]
                         for struct_member, struct_type, pointer_flag, member_idx in zip(struct.struct_members, struct.struct_types, struct.pointer_flags, struct.member_idc):
                             # Whether the parameter is an array
                             if member_idx:
@@ -1178,7 +2483,7 @@ class FunctionParser(PreProcessor):
                         if param.arg_pointer_flag:
                             init_param_infos.append(f'    {arg_name}_p = byref({arg_name})\n')
                             arg_name = arg_name + '_p'
-                    elif 'CFUNCTYPE' in arg_type:
+                    elif arg_kind == 'func_ptr':
                         # function pointer, which means this is a device initiation function. I should manually write it
                         logging_infos = list()
                         break
@@ -1212,42 +2517,236 @@ class ArrayParser(PreProcessor):
         """
         def __init__(self):
             self.arr_name = None                # string
+            self.arr_type = None                # ctypes name of the elements, None if unknown
             self.arr_idc = list()                # list of array indices
+            self.arr_dims = list()              # list of integer, None if the size is omitted, e.g. a[]
             self.arr_val = list()               # list of the whole array matrix
+            self.arr_data = None                # (typecode, shape, bytes) if the array is written in binary
+            self.header_file = None             # name of header file without ".h"
+
+    def get_array_type(self, type_name: str):
+        """
+        Return the ctypes name of the elements of array, the qualifiers before the type are skipped
+        """
+        words = type_name.split()
+        for i in range(len(words)):
+            type_name = ' '.join(words[i:])
+            if type_name in self.symbol_dict:
+                arr_type, is_ptr = self.convert_to_ctypes(type_name, False)
+                return None if is_ptr else arr_type
+        return None
 
     def generate_array_list(self):
         """
         Write large array in C to py
+        The initializer of each array is found by the first ";" after it. In binary format, its elements are scanned
+        into a typed buffer at once, see scan_initializer(). Otherwise, or if that fails, its text is kept as a list.
         """
-        for lines in self.intermediate_h_files:
-            lines = re.findall(r'\w+\s+(\w+)\s*(\[.*])\s*=([^;]+);', lines)
-            for content in lines:
+        is_binary = self.env.get('array_format', 'list') == 'binary' and not self.env.get('per_header_package', False)
+        value_cache = dict()            # key = text of element, value = its value
+        for lines, h_file in zip(self.intermediate_h_files, self.h_files):
+            pos = 0
+            while True:
+                head = array_head_pattern.search(lines, pos)
+                if head is None:
+                    break
+                end = lines.find(';', head.end())
+                if end < 0:
+                    break
+                pos = end + 1
                 arr = self._Array()
-                arr.arr_name = content[0]
+                type_name, arr.arr_name, idc_text = head.groups()
+                arr.arr_type = self.get_array_type(type_name)
+                arr.header_file = os.path.basename(h_file)[:-2]
                 # parsing the array indices
-                idcs = re.findall(r'\[([\d\s*/+\-()]+)?]', content[1])
-                for idc in idcs:
+                for idc in re.findall(r'\[([^\]]*)]', idc_text):
+                    if not idc.strip():                 # size omitted, e.g. int a[] = {1, 2};
+                        if arr.arr_dims is not None:
+                            arr.arr_dims.append(None)
+                        continue
                     try:
-                        arr.arr_idc.append(str(eval(idc)))
-                    except Exception:
-                        traceback.print_exc()
-                        logging.error(f'Unrecognized expression in C array: {content[0]}{content[1]}')
-                arr.arr_val = re.sub('{', '[', content[2].strip())
-                arr.arr_val = re.sub('}', ']', arr.arr_val)
+                        size = self.eval_c_expr(idc)
+                    except CExprError:
+                        logging.error(f'Unrecognized expression in C array: {arr.arr_name}{idc_text.strip()}')
+                        arr.arr_dims = None
+                        continue
+                    arr.arr_idc.append(str(size))
+                    if arr.arr_dims is not None:
+                        arr.arr_dims.append(int(size))
+                if is_binary:
+                    arr.arr_data = self.get_array_data(arr, lines, head.end(), end, value_cache)
+                    if arr.arr_data is None:
+                        logging.warning(f'Array {arr.arr_name} is written as a list, the type or initializer is not '
+                                        f'supported in binary')
+                if arr.arr_data is None:
+                    arr.arr_val = lines[head.end():end].strip().translate(brace_to_bracket_table)
                 self.array_list.append(arr)
 
+    def get_array_typecode(self, arr_type: str):
+        """
+        Return the typecode of array.array for the ctypes name of elements, None if there is no such typecode
+        """
+        if arr_type == 'c_float':
+            return 'f'
+        if arr_type == 'c_double':
+            return 'd'
+        if self.PLATFORM_BIT_SCALER == 1:   # 32bit
+            size = self.sizeof_basic_c_type_dict_32bit.get(arr_type)
+        else:   # 64 bit
+            size = self.sizeof_basic_c_type_dict_64bit.get(arr_type)
+        if size is None or arr_type in ('c_longdouble', 'c_wchar', 'c_char'):
+            return None
+        for typecode in 'bhilq':
+            if arr_type in self.unsigned_ctypes_lib_vars:
+                typecode = typecode.upper()
+            if array.array(typecode).itemsize == int(size):
+                return typecode
+        return None
+
+    def eval_array_element(self, text: str):
+        """
+        Evaluate an element of initializer, plain integers are converted without the C expression parser
+        """
+        try:
+            return int(text, 0)
+        except ValueError:
+            return self.eval_c_expr(text)
+
+    def scan_initializer(self, lines: str, start: int, end: int, typecode: str, dims: list, value_cache: dict) -> tuple:
+        """
+        Walk the braces and elements of the C initializer in lines[start:end] once, and put the elements into an
+        array.array of typecode in row-major order. As in C, braces of sub-arrays may be omitted and the missing
+        elements are 0. An element is evaluated once for each distinct text, e.g. a macro or sizeof() repeated in a
+        table. Return (data, shape), raise ValueError if the initializer does not fit the dimensions.
+        """
+        strides = [functools.reduce(operator.mul, dims[i + 1:], 1) for i in range(len(dims))]
+        data = array.array(typecode)
+        start_stack = list()            # index in data where each open brace starts
+        for match in initializer_token_pattern.finditer(lines, start, end):
+            token = match.group()
+            if token == '{':
+                level = len(start_stack)
+                if level >= len(dims):
+                    raise ValueError('Too many braces in initializer')
+                if level:
+                    data.frombytes(bytes(-len(data) % strides[level - 1] * data.itemsize))     # start of sub-array
+                start_stack.append(len(data))
+            elif token == '}':
+                if not start_stack:
+                    raise ValueError('Unbalanced braces in initializer')
+                level = len(start_stack) - 1
+                begin = start_stack.pop()
+                if level:
+                    size = strides[level - 1]
+                elif dims[0] is not None:
+                    size = dims[0] * strides[0]
+                else:
+                    size = -(-len(data) // strides[0]) * strides[0]
+                if len(data) - begin > size:
+                    raise ValueError('Too many elements in initializer')
+                data.frombytes(bytes((begin + size - len(data)) * data.itemsize))
+            else:
+                texts = token.split(',')
+                if not texts[-1].strip():
+                    texts.pop()                 # after the last element, e.g. {1, 2, }
+                if texts and not texts[0].strip():
+                    texts.pop(0)                # after a sub-array, e.g. {{1}, 2}
+                if not texts:
+                    continue
+                if not start_stack:
+                    raise ValueError('Element out of braces in initializer')
+                try:
+                    data.extend(list(map(int, texts, itertools.repeat(0))))     # plain integers
+                except ValueError:
+                    for text in texts:
+                        text = text.strip()
+                        value = value_cache.get(text)
+                        if value is None:
+                            value = value_cache[text] = self.eval_array_element(text)
+                        data.append(value)
+        if start_stack or not data:
+            raise ValueError('Incomplete initializer')
+        return data, (len(data) // strides[0],) + tuple(dims[1:])
+
+    def get_array_data(self, arr: _Array, lines: str, start: int, end: int, value_cache: dict):
+        """
+        Return (typecode, shape, data in native byte order) of array, None if it can only be written as a list
+        """
+        typecode = self.get_array_typecode(arr.arr_type)
+        if typecode is None or not arr.arr_dims or None in arr.arr_dims[1:]:
+            return None
+        try:
+            data, shape = self.scan_initializer(lines, start, end, typecode, arr.arr_dims, value_cache)
+        except (ValueError, TypeError, OverflowError):
+            return None
+        return typecode, shape, data.tobytes()
+
     def write_arr_into_py(self):
+        """
+        generate c_arrays.py
+        Set "array_format" to "binary" in config to keep the data of arrays of numbers in c_arrays_data/<name>.bin,
+        they are read into compact memoryviews on first use instead of being compiled as lists.
+        """
         if self.array_list:
-            with open(os.path.join('output', 'c_arrays.py'), 'w') as fp:
+            binary_arr_dict = dict()        # key = name of array, value = (typecode, shape)
+            data_path = os.path.join('output', 'c_arrays_data')
+            for arr in self.array_list:
+                if arr.arr_data is None:
+                    continue
+                if not os.path.exists(data_path):
+                    os.mkdir(data_path)
+                write_output_file(os.path.join(data_path, f'{arr.arr_name}.bin'), arr.arr_data[2], compile_py=False)
+                binary_arr_dict[arr.arr_name] = arr.arr_data[:2]
+
+            with open_output_file(os.path.join('output', 'c_arrays.py'), self.env.get('compile_output', True)) as fp:
                 fp.write('"""\n')
                 fp.write('    @usage: Conversion result of Arrays\n')
                 fp.write('"""\n')
                 fp.write('from structure_class import *\n\n')
+                if binary_arr_dict:
+                    self.write_binary_arr_loader(fp, binary_arr_dict)
                 for arr in self.array_list:
+                    if arr.arr_data is not None:
+                        continue
                     arr_idc = '*'.join(arr.arr_idc)
                     fp.write(f'# Array size: {arr_idc}\n')
                     fp.write(f'{arr.arr_name} = {arr.arr_val}\n\n')
 
+    @staticmethod
+    def write_binary_arr_loader(fp, binary_arr_dict: dict):
+        """
+        Write the loader of arrays kept in c_arrays_data, an array is loaded by the module level __getattr__ when it
+        is used first
+        """
+        fp.write('import os\nimport array\n\n')
+        fp.write('# key = name of array, value = (typecode of array.array, shape)\n')
+        fp.write('_array_dict = {\n')
+        for name, (typecode, shape) in binary_arr_dict.items():
+            fp.write(f'    {name!r}: ({typecode!r}, {shape!r}),\n')
+        fp.write('}\n\n\n')
+
+        fp.write('def get_array_path(name):\n')
+        fp.write('    """\n')
+        fp.write('    Path of the data of array in native byte order, e.g. numpy.memmap(get_array_path(name), typecode, "r", 0, shape)\n')
+        fp.write('    """\n')
+        fp.write('    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "c_arrays_data", name + ".bin")\n\n\n')
+
+        fp.write('def load_array(name):\n')
+        fp.write('    """\n')
+        fp.write('    Read the data of array into a memoryview in the shape of the C array, e.g. arr[1, 2], arr.tolist()\n')
+        fp.write('    """\n')
+        fp.write('    typecode, shape = _array_dict[name]\n')
+        fp.write('    data = array.array(typecode)\n')
+        fp.write('    with open(get_array_path(name), "rb") as fp:\n')
+        fp.write('        data.frombytes(fp.read())\n')
+        fp.write('    return memoryview(data).cast("B").cast(typecode, shape)\n\n\n')
+
+        fp.write('def __getattr__(name):\n')
+        fp.write('    if name not in _array_dict:\n')
+        fp.write('        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")\n')
+        fp.write('    value = globals()[name] = load_array(name)\n')
+        fp.write('    return value\n\n\n')
+
 
 class Parser(TypeDefParser, StructUnionParser, EnumParser, FunctionParser, ArrayParser):
     """
@@ -1260,11 +2759,68 @@ class Parser(TypeDefParser, StructUnionParser, EnumParser, FunctionParser, Array
                             datefmt='%d-%M-%Y %H:%M:%S')
         FunctionParser.__init__(self)
         TypeDefParser.__init__(self)
+        self.profile_start_time = None      # set while profiling, see profiling()
 
     def __call__(self, skip_output=False):
         """
         Main function when you use this parser
         """
+        with self.profiling():
+            with self.stage('collect_files'):
+                self.collect_files()
+            self.convert(skip_output)
+
+    @contextlib.contextmanager
+    def profiling(self):
+        """
+        Trace the memory allocated by python and write profile.json next to debug.log after conversion when profiling.
+        It does nothing inside another profiling(), so that both __call__() and convert() can be profiled.
+        """
+        if not self.is_profiling or self.profile_start_time is not None:
+            yield
+            return
+        is_tracing = not tracemalloc.is_tracing()
+        if is_tracing:
+            tracemalloc.start()
+        self.profile_start_time = time.perf_counter()
+        try:
+            yield
+            self.write_profile(time.perf_counter() - self.profile_start_time)
+        finally:
+            self.profile_start_time = None
+            if is_tracing:
+                tracemalloc.stop()
+
+    def write_profile(self, seconds: float):
+        """
+        Write the time and peak memory of each stage and the counters of conversion into profile.json.
+        The time includes the overhead of tracemalloc, compare it with the total time of a run without profiling.
+        """
+        self.count('h_files', len(self.h_files))
+        self.count('c_files', len(self.c_files))
+        self.count('macros', len(self.macro_dict))
+        self.count('enums', len(self.enum_class_list))
+        self.count('structs', len(self.struct_class_list))
+        self.count('func_pointers', len(self.func_pointer_dict))
+        self.count('functions', len(self.func_list))
+        self.count('arrays', len(self.array_list))
+        profile = {
+            'python': sys.version.split()[0],
+            'seconds': round(seconds, 6),
+            'peak_memory': max((peak for _, _, peak in self.stage_list), default=0),
+            'stages': [{'name': name, 'seconds': round(stage_seconds, 6), 'peak_memory': peak}
+                       for name, stage_seconds, peak in self.stage_list],
+            'counters': dict(sorted(self.counter_dict.items())),
+        }
+        write_output_file('profile.json', json.dumps(profile, indent=4) + '\n', compile_py=False)
+
+    def collect_files(self):
+        """
+        Collect the header files and C files in the configured header_files and project_folders, the files collected
+        before are dropped, so that the removed files are not converted again in watch mode
+        """
+        self.h_files = list()
+        self.c_files = list()
         h_files_to_parse = self.env.get('header_files', list())
         dir_paths = list()
         for file_path in h_files_to_parse:
@@ -1293,33 +2849,73 @@ class Parser(TypeDefParser, StructUnionParser, EnumParser, FunctionParser, Array
         self.h_files = unique_list(self.h_files)
         self.c_files = unique_list(self.c_files)
 
-        self.pre_process()
-
-        self.parse()
-
-        if not skip_output:
-            self.write_to_file()
-
-        self.generate_func_list_from_h_files()
-        self.write_funcs_to_wrapper()
+    def convert(self, skip_output=False):
+        """
+        Convert the collected files
+        """
+        with self.profiling():
+            with self.stage('load_cache'):
+                self.load_cache()
+            if self.env.get('workers', 1) > 1:
+                self.executor = ProcessPoolExecutor(self.env['workers'])
+            try:
+                with self.stage('pre_process'):
+                    self.pre_process()
+                with self.stage('parse'):
+                    self.parse()
+            finally:
+                if self.executor is not None:
+                    self.executor.shutdown()
+                    self.executor = None
+            with self.stage('save_cache'):
+                self.save_cache()
+
+            if self.env.get('per_header_package', False):
+                with self.stage('generate_func_list_from_h_files'):
+                    self.generate_func_list_from_h_files()
+                if not skip_output:
+                    with self.stage('write_package'):
+                        self.write_package()
+                    with self.stage('write_struct_layout_into_py'):
+                        self.write_struct_layout_into_py()
+                    if self.env.get('numpy_dtypes', False):
+                        with self.stage('write_numpy_dtypes_into_py'):
+                            self.write_numpy_dtypes_into_py()
+                return
+
+            if not skip_output:
+                with self.stage('write_to_file'):
+                    self.write_to_file()
+
+            with self.stage('generate_func_list_from_h_files'):
+                self.generate_func_list_from_h_files()
+            with self.stage('write_funcs_to_wrapper'):
+                self.write_funcs_to_wrapper()
 
     def parse(self):
         """
         Parse the header files
         """
-        for i, lines in enumerate(self.intermediate_h_files):
-            lines = self.parse_sizeof_basic_type(lines)
-            self.intermediate_h_files[i] = lines
-        self.check_macro()
-        self.generate_typedef_mapping_dict()
-        self.generate_enum_class_list()
-        for i, lines in enumerate(self.intermediate_h_files):
-            lines = self.replace_macro(lines)
-            self.intermediate_h_files[i] = lines
-        self.generate_func_ptr_dict()
-        self.generate_struct_union_class_list()
-        self.convert_structure_class_to_ctypes()
-        self.generate_array_list()
+        replace_sizeof = functools.partial(replace_sizeof_basic_type,
+                                           sizeof_basic_type_dict=self.get_sizeof_basic_type_dict())
+        with self.stage('replace_sizeof'):
+            self.intermediate_h_files = self.map_in_workers(replace_sizeof, self.intermediate_h_files)
+        with self.stage('check_macro'):
+            self.check_macro()
+        with self.stage('generate_typedef_mapping_dict'):
+            self.generate_typedef_mapping_dict()
+        with self.stage('generate_enum_class_list'):
+            self.generate_enum_class_list()
+        with self.stage('replace_macro'):
+            self.replace_macro_in_files()
+        with self.stage('generate_func_ptr_dict'):
+            self.generate_func_ptr_dict()
+        with self.stage('generate_struct_union_class_list'):
+            self.generate_struct_union_class_list()
+        with self.stage('convert_structure_class_to_ctypes'):
+            self.convert_structure_class_to_ctypes()
+        with self.stage('generate_array_list'):
+            self.generate_array_list()
 
     def write_to_file(self):
         """
@@ -1327,22 +2923,132 @@ class Parser(TypeDefParser, StructUnionParser, EnumParser, FunctionParser, Array
         """
         if not os.path.exists('output'):
             os.mkdir('output')
-        self.write_enum_class_into_py()
-        self.write_structure_class_into_py()
-        self.write_arr_into_py()
+        with self.stage('write_enum_class_into_py'):
+            self.write_enum_class_into_py()
+        with self.stage('write_structure_class_into_py'):
+            self.write_structure_class_into_py()
+        with self.stage('write_struct_layout_into_py'):
+            self.write_struct_layout_into_py()
+        if self.env.get('numpy_dtypes', False):
+            with self.stage('write_numpy_dtypes_into_py'):
+                self.write_numpy_dtypes_into_py()
+        with self.stage('write_arr_into_py'):
+            self.write_arr_into_py()
+        with self.stage('check_struct_layouts'):
+            self.check_struct_layouts()
+
+    def get_module_name(self, header_file: str) -> str:
+        """
+        Name of the submodule of a header file in the package
+        """
+        module_name = re.sub(r'\W', '_', header_file)
+        if not module_name or module_name[0].isdigit() or keyword.iskeyword(module_name):
+            module_name = '_' + module_name
+        return module_name
+
+    def write_package(self):
+        """
+        Write the enums, structures, arrays and APIs of each header file into a submodule of output/<package_name>.
+        The __init__.py of the package keeps an index of the names, a submodule is only imported when one of its names
+        is used first. The submodule imports the types it needs from other submodules.
+        """
+        package_name = self.env.get('package_name', 'c_api')
+        package_path = os.path.join('output', package_name)
+        if not os.path.exists(package_path):
+            os.makedirs(package_path)
+
+        # key = name of submodule, value = list of (source, names it depends on)
+        module_dict = dict()
+        index_dict = dict()         # key = name of enum, structure, array or API, value = name of submodule
+        func_module_set = set()     # submodules with APIs
+
+        def add_source(header_file: str, name: str, source: str, dependent_types: str):
+            module_name = self.get_module_name(header_file or '')
+            module_dict.setdefault(module_name, list()).append((source, c_identifier_pattern.findall(dependent_types)))
+            index_dict[name] = module_name
+            return module_name
+
+        for enum in self.enum_class_list:
+            add_source(enum.header_file, enum.enum_name, self.get_enum_class(enum), '')
+        for name, header_file, source, dependent_types in self.iter_struct_and_func_ptr_types():
+            add_source(header_file, name, source, dependent_types)
+        for arr in self.array_list:
+            arr_idc = '*'.join(arr.arr_idc)
+            add_source(arr.header_file, arr.arr_name, f'# Array size: {arr_idc}\n{arr.arr_name} = {arr.arr_val}\n', '')
+        for func in self.func_list:
+            arg_types, wrapper = self.get_func_wrapper(func)
+            source = f'_c_{func.func_name} = _bind("{func.func_name}", {arg_types}, {func.ret_type})\n\n\n{wrapper}'
+            func_module_set.add(add_source(func.header_file, func.func_name, source, f'{arg_types} {func.ret_type}'))
+
+        import_graph = dict()       # key = name of submodule, value = dict of submodule -> names imported from it
+        for module_name, sources in module_dict.items():
+            import_dict = import_graph.setdefault(module_name, dict())
+            for _, dependent_names in sources:
+                for name in dependent_names:
+                    dependent_module = index_dict.get(name)
+                    if dependent_module is not None and dependent_module != module_name:
+                        import_dict.setdefault(dependent_module, dict()).setdefault(name)
+        for component in self.find_include_loops(import_graph):
+            if len(component) > 1:
+                logging.error(f'Submodules {", ".join(component)} import each other, please move the structures they '
+                              f'share into one header file')
+
+        for module_name, sources in module_dict.items():
+            module_path = os.path.join(package_path, f'{module_name}.py')
+            with open_output_file(module_path, self.env.get('compile_output', True)) as fp:
+                fp.write('"""\n')
+                fp.write(f'    @usage: Conversion result of {module_name}.h\n')
+                fp.write('"""\n')
+                fp.write('from ctypes import *\n')
+                fp.write('from enum import Enum, unique, IntEnum\n')
+                if module_name in func_module_set:
+                    fp.write('from . import _bind, _buffer_arg\n')
+                for dependent_module, names in import_graph[module_name].items():
+                    fp.write(f'from .{dependent_module} import {", ".join(names)}\n')
+                fp.write('\n\n')
+                for source, _ in sources:
+                    fp.write(source)
+                    fp.write('\n\n')
+
+        with open_output_file(os.path.join(package_path, '__init__.py'), self.env.get('compile_output', True)) as fp:
+            fp.write('"""\n')
+            fp.write('    @usage: Conversion result of header files, the submodule of a header file is imported on first use\n')
+            fp.write('"""\n')
+            fp.write('import os\nimport ctypes\nimport importlib\nfrom ctypes import CDLL\n\n')
+            fp.write(self.get_lib_loader())
+            fp.write('\n\n')
+            fp.write(self.get_bind_func(is_lazy=True))
+            fp.write('\n\n')
+            fp.write(self.get_buffer_arg_func())
+            fp.write('\n\n')
+            fp.write('# key = name of enum, structure, array or API, value = submodule\n')
+            fp.write('_index = {\n')
+            for name, module_name in index_dict.items():
+                fp.write(f'    {name!r}: {module_name!r},\n')
+            fp.write('}\n\n\n')
+            fp.write('def __getattr__(name):\n')
+            fp.write(f'    if name == "{self.dll_name}":\n')
+            fp.write('        return _get_lib()\n')
+            fp.write('    if name not in _index:\n')
+            fp.write('        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")\n')
+            fp.write('    value = globals()[name] = getattr(importlib.import_module("." + _index[name], __name__), name)\n')
+            fp.write('    return value\n\n\n')
+            fp.write('def __dir__():\n')
+            fp.write('    return sorted(set(globals()) | set(_index))\n\n\n')
+            fp.write('__all__ = list(_index)\n')
 
     def generate_func_ptr_dict(self):
         # parse header files
-        for lines in self.intermediate_h_files:
-            lines = re.findall(r'typedef\s+(\w+)\s*\(\*\s*([\w]+)\s*\)\s*\((.*?)\)\s*;', lines, re.S)
-            for content in lines:            # For each function pointer
+        for declarations, h_file in zip(self.declaration_list, self.h_files):
+            header_file = os.path.basename(h_file)[:-2]
+            for content in declarations['func_ptrs']:            # For each function pointer
                 val = list()
                 ret_type = content[0]
                 if '*' in ret_type:
                     ret_type, ret_pointer_flag = self.convert_to_ctypes(ret_type, True)
                 else:
                     ret_type, ret_pointer_flag = self.convert_to_ctypes(ret_type, False)
-                if ret_type in self.enum_class_name_list:
+                if self.get_symbol_kind(ret_type) == 'enum':
                     ret_type = 'c_int'
                 if ret_pointer_flag:
                     val.append(f'POINTER({ret_type})')
@@ -1352,19 +3058,22 @@ class Parser(TypeDefParser, StructUnionParser, EnumParser, FunctionParser, Array
                 key = content[1]
                 param_list = self.parse_func_parameters(content[2])
                 for param in param_list:
-                    if param.arg_type in self.enum_class_name_list:
+                    if self.get_symbol_kind(param.arg_type) == 'enum':
                         param.arg_type = 'c_int'
                     if param.arg_pointer_flag:
                         val.append(f'POINTER({param.arg_type})')
                     else:
                         val.append(f'{param.arg_type}')
                 self.func_pointer_dict.setdefault(key, val)
+                self.add_symbol(key, 'func_ptr')
+                self.func_pointer_header_dict.setdefault(key, header_file)
 
 
 if __name__ == '__main__':
     # logging.basicConfig(format='%(levelname)s! File: %(filename)s Line %(lineno)d; Msg: %(message)s', datefmt='%d-%M-%Y %H:%M:%S')
 
     parser = Parser()
+    parser.is_profiling = parser.is_profiling or '--profile' in sys.argv[1:]
     parser()
 
     # from output.enum_class import *
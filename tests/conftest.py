@@ -0,0 +1,26 @@
+import os
+import sys
+import json
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parse
+
+
+@pytest.fixture
+def parser(tmp_path, monkeypatch):
+    """
+    Parser with an empty config.json in a temporary working folder
+    """
+    monkeypatch.chdir(tmp_path)
+    config = {
+        'header_files': [],
+        'project_folders': [],
+        'exception_dict': {},
+        'predefined_macro_dict': {'NULL': '0'},
+        'use_cache': False,
+    }
+    with open('config.json', 'w') as fp:
+        json.dump(config, fp)
+    return parse.Parser()
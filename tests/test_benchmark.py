@@ -0,0 +1,63 @@
+import os
+import pytest
+
+import parse
+from benchmark.generate import DEFAULT_KNOB_DICT, SyntheticProject, write_config, parse_knobs
+from benchmark.run import get_scaling_exponent, compare_with_baseline
+
+
+def test_scaling_exponent():
+    sizes = [1, 2, 4, 8]
+    assert get_scaling_exponent(sizes, [0.5 * size for size in sizes]) == pytest.approx(1.0)
+    assert get_scaling_exponent(sizes, [0.1 * size ** 2 for size in sizes]) == pytest.approx(2.0)
+
+
+def get_result(exponent: float, **knob_dict) -> dict:
+    return {
+        'knob': 'headers',
+        'sizes': [1, 2, 4],
+        'knob_dict': dict(DEFAULT_KNOB_DICT, **knob_dict),
+        'stages': {'parse': {'seconds': [0.1, 0.2, 0.4 * 2 ** (exponent - 1)], 'exponent': exponent}},
+    }
+
+
+def test_compare_with_baseline():
+    assert compare_with_baseline(get_result(1.1), get_result(1.0), 0.25, 0.01) == []
+    assert len(compare_with_baseline(get_result(2.0), get_result(1.0), 0.25, 0.01)) == 1
+    assert compare_with_baseline(get_result(2.0), get_result(1.0), 0.25, 10.0) == []       # too fast to compare
+
+
+@pytest.mark.parametrize('baseline', [
+    dict(get_result(1.0), knob='macros'),
+    dict(get_result(1.0), sizes=[1, 2, 8]),
+    get_result(1.0, include_cycles=8),
+])
+def test_incomparable_baseline(baseline):
+    with pytest.raises(ValueError):
+        compare_with_baseline(get_result(1.0), baseline, 0.25, 0.01)
+
+
+def test_project_is_deterministic():
+    assert SyntheticProject(headers=4).get_header(3) == SyntheticProject(headers=4).get_header(3)
+    assert SyntheticProject(headers=4, seed=1).include_dict != SyntheticProject(headers=4).include_dict
+
+
+def test_include_cycles_are_loops(parser):
+    project = SyntheticProject(headers=6, include_density=0.0, include_cycles=1)
+    graph = {i: dict.fromkeys(included) for i, included in project.include_dict.items()}
+    assert max(len(component) for component in parser.find_include_loops(graph)) == 2
+
+
+def test_parse_knobs():
+    assert parse_knobs(['headers=4', 'include_density=0.5']) == {'headers': 4, 'include_density': 0.5}
+    with pytest.raises(ValueError):
+        parse_knobs(['unknown=1'])
+
+
+def test_project_converts(parser):
+    SyntheticProject(headers=3, structs=2, functions=2).write('prj')
+    write_config(os.getcwd(), 'prj', profile=False)
+    parser = parse.Parser()
+    parser()
+    assert len(parser.struct_class_list) == 3 * 2
+    assert len(parser.func_list) == 3 * 2
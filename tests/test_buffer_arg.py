@@ -0,0 +1,57 @@
+import array
+import ctypes
+import pytest
+
+
+@pytest.fixture
+def buffer_arg(parser):
+    namespace = {'ctypes': ctypes}
+    exec(parser.get_buffer_arg_func(), namespace)
+    return namespace['_buffer_arg']
+
+
+@pytest.mark.parametrize('obj', [
+    ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int)(lambda x: x),
+    ctypes.pointer(ctypes.c_int(1)),
+    ctypes.c_void_p(16),
+    (ctypes.c_int * 4)(),
+    ctypes.c_double(1.5),
+    None,
+    b'bytes',
+    0,
+])
+def test_ctypes_and_python_objects_are_passed_as_they_are(buffer_arg, obj):
+    assert buffer_arg(obj, ctypes.c_char) is obj
+    assert buffer_arg(obj, ctypes.c_int) is obj
+
+
+def test_structure_is_passed_as_it_is(buffer_arg):
+    class Point(ctypes.Structure):
+        _fields_ = [('x', ctypes.c_int), ('y', ctypes.c_int)]
+
+    point = Point(1, 2)
+    assert buffer_arg(point, ctypes.c_char) is point
+
+
+def test_buffer_is_passed_without_copy(buffer_arg):
+    items = array.array('i', [1, 2, 3])
+    arg = buffer_arg(items, ctypes.c_int)
+    arg._obj.value = 7
+    assert items[0] == 7
+
+
+@pytest.mark.parametrize('items, ctype', [
+    (array.array('h', [1, 2]), ctypes.c_int),       # item size differs
+    (array.array('f', [1.0]), ctypes.c_int),        # floating point items for an integer type
+    (array.array('i', [1]), ctypes.c_float),        # integer items for a floating point type
+])
+def test_buffer_of_other_items_is_refused(buffer_arg, items, ctype):
+    with pytest.raises(TypeError):
+        buffer_arg(items, ctype)
+
+
+def test_buffer_of_bytes_is_raw_memory(buffer_arg):
+    data = bytearray(8)
+    arg = buffer_arg(data, ctypes.c_int)
+    arg._obj.value = -1
+    assert data == bytearray(b'\xff' * 4 + b'\x00' * 4)
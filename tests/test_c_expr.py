@@ -0,0 +1,57 @@
+import pytest
+
+import parse
+
+
+@pytest.mark.parametrize('expr, value', [
+    ('-7 / 2', -3),
+    ('-7 % 2', -1),
+    ('0u - 1', 0xFFFFFFFF),
+    ('0xFFFFFFFF + 1', 0),
+    ('(unsigned char)300', 44),
+    ('1 ? 2 : 3', 2),
+    ('1 << 4 | 1', 17),
+    ('-1 < 0xFFFFFFFF', 0),             # -1 is converted to unsigned int
+    ('sizeof(int) * 2', 8),
+])
+def test_eval_with_c_semantics(parser, expr, value):
+    assert parser.eval_c_expr(expr) == value
+
+
+@pytest.mark.parametrize('expr, flag', [
+    ('0xFFFFFFFF + 1 == 0', False),     # the integers in #if are 64 bits
+    ('0xFFFFFFFF + 1 == 0x100000000', True),
+    ('-1 < 0xFFFFFFFF', True),
+    ('-1 < 0u', False),
+    ('0xFFFFFFFFFFFFFFFF + 1 == 0', True),
+    ('UNKNOWN == 0', True),
+    ('defined(UNKNOWN)', False),
+])
+def test_if_clause_has_width_of_intmax(parser, expr, flag):
+    assert parser.check_if_clause(expr) == flag
+
+
+def test_unknown_identifier_outside_if_clause(parser):
+    with pytest.raises(parse.CExprError):
+        parser.eval_c_expr('UNKNOWN + 1')
+
+
+def test_macro_value_is_forgotten_when_used_macro_changes(parser):
+    parser.macro_dict['A'] = '(1)'
+    parser.macro_dict['B'] = '(A + 1)'
+    parser.macro_dict['C'] = '(2)'
+    assert parser.eval_c_expr('B * C') == 4
+    assert parser.check_if_clause('B > 3') is False
+    parser.macro_dict['A'] = '(5)'
+    assert parser.eval_c_expr('B * C') == 12
+    assert parser.check_if_clause('B > 3') is True
+    assert ('C', False) in parser.c_macro_value_dict        # the macros which do not use A are kept
+
+
+def test_if_clause_is_evaluated_again_when_macro_is_defined(parser):
+    assert parser.check_if_clause('defined(A) || B') is False
+    parser.macro_dict['B'] = 1
+    assert parser.check_if_clause('defined(A) || B') is True
+    del parser.macro_dict['B']
+    parser.macro_dict['A'] = ''
+    assert parser.check_if_clause('defined(A) || B') is True
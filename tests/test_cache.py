@@ -0,0 +1,78 @@
+import os
+import json
+import pytest
+
+import parse
+
+headers = {
+    'base.h': '''
+#define COUNT 4
+typedef unsigned int U32;
+typedef enum {
+    RED = COUNT,
+    GREEN
+} COLOR;
+''',
+    'dev.h': '''
+#include "base.h"
+typedef struct _DEV {
+    U32 id;
+    COLOR color;
+    char name[COUNT];
+} DEV, *PDEV;
+typedef int (*CALLBACK)(DEV *dev);
+__declspec(dllexport) U32 open_dev(PDEV dev, CALLBACK callback);
+''',
+}
+
+
+def convert() -> parse.Parser:
+    parser = parse.Parser()
+    parser()
+    return parser
+
+
+@pytest.fixture
+def project(parser):
+    os.mkdir('prj')
+    for name, lines in headers.items():
+        with open(os.path.join('prj', name), 'w') as fp:
+            fp.write(lines)
+    with open('config.json', 'r') as fp:
+        config = json.load(fp)
+    config.update(project_folders=['prj'], use_cache=True)
+    with open('config.json', 'w') as fp:
+        json.dump(config, fp)
+    return os.path.join(os.getcwd(), 'prj')
+
+
+def get_result(parser: parse.Parser) -> tuple:
+    return (parser.intermediate_h_files, dict(parser.macro_dict),
+            [(s.struct_name, s.struct_members, s.struct_types) for s in parser.struct_class_list],
+            [(e.enum_name, e.enum_members, e.enum_values) for e in parser.enum_class_list],
+            [(f.func_name, f.ret_type, [p.arg_type for p in f.parameters]) for f in parser.func_list],
+            parser.func_pointer_dict)
+
+
+def test_unchanged_files_are_not_preprocessed_again(project, monkeypatch):
+    result = get_result(convert())
+
+    def fail(*args):
+        raise AssertionError('cached file is processed again')
+
+    monkeypatch.setattr(parse.Parser, 'check_macro_in_file', fail)
+    monkeypatch.setattr(parse.Parser, 'replace_macro', fail)
+    assert get_result(convert()) == result
+
+
+def test_changed_macro_invalidates_the_files_using_it(project):
+    convert()
+    with open(os.path.join(project, 'base.h'), 'a') as fp:
+        fp.write('#define EXTRA 1\n')
+    assert convert().macro_dict['EXTRA'] == 1
+    with open(os.path.join(project, 'base.h'), 'w') as fp:
+        fp.write(headers['base.h'].replace('#define COUNT 4', '#define COUNT 8'))
+    parser = convert()
+    dev = next(s for s in parser.struct_class_list if s.struct_name == 'DEV')
+    assert dev.member_idc[dev.struct_members.index('name')] == 8
+    assert next(e for e in parser.enum_class_list if e.enum_name == 'COLOR').enum_values == [8, 9]
@@ -0,0 +1,34 @@
+import pytest
+
+
+def sort_headers(parser, include_dict: dict) -> list:
+    """
+    Write a header for each key, which includes the headers of its value, and sort them in the order of the keys
+    """
+    for name, included_names in include_dict.items():
+        with open(name, 'w') as fp:
+            fp.write(''.join(f'#include "{included_name}"\n' for included_name in included_names))
+    parser.h_files = list(include_dict)
+    return parser.sort_h_files()
+
+
+def test_headers_without_loop_follow_includes(parser):
+    include_dict = {'a.h': ['b.h'], 'b.h': ['c.h'], 'c.h': []}
+    assert sort_headers(parser, include_dict) == ['c.h', 'b.h', 'a.h']
+
+
+@pytest.mark.parametrize('include_dict, sorted_list', [
+    # the includes of h2 chain h1 -> h0 -> h2 and those of h3 chain h0 -> h1, the loop is h0, h1 and h2
+    ({'h1.h': [], 'h0.h': [], 'h3.h': ['h2.h', 'h0.h', 'h1.h'], 'h2.h': ['h1.h', 'h0.h']},
+     ['h2.h', 'h1.h', 'h0.h', 'h3.h']),
+    ({'h0.h': [], 'h1.h': [], 'h2.h': ['h1.h', 'h0.h'], 'h3.h': ['h2.h', 'h0.h', 'h1.h']},
+     ['h1.h', 'h0.h', 'h2.h', 'h3.h']),
+    # two headers including each other, and a third one including both
+    ({'a.h': ['b.h'], 'b.h': ['a.h'], 'c.h': ['a.h', 'b.h']},
+     ['b.h', 'a.h', 'c.h']),
+    # the loops of a.h, b.h and of c.h, d.h include each other, they are squeezed one after another
+    ({'a.h': ['b.h', 'c.h'], 'b.h': ['a.h'], 'c.h': ['d.h', 'a.h'], 'd.h': ['c.h']},
+     ['d.h', 'b.h', 'a.h', 'c.h']),
+])
+def test_loops_keep_order_of_node_graph(parser, include_dict, sorted_list):
+    assert sort_headers(parser, include_dict) == sorted_list
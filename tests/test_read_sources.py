@@ -0,0 +1,35 @@
+import io
+import pytest
+
+import parse
+
+
+@pytest.mark.parametrize('lines, kept', [
+    ('#include "a.h"\n// comment\n/* comment */\n#include "b.h"\nint x;\n#include "c.h"\n', 4),
+    ('#include "a.h" /* comment\n   which goes on */\n#include "b.h"\nint x;\n', 3),
+    ('/* comment\n#include "x.h"\n */\n#include "b.h"\nint x;\n', 4),
+    ('#define A(x) \\\n    ((x) + 1) /* comment\n   which goes on */\n#include "b.h"\nint x;\n', 4),
+    ('#define TEXT "/*"\n#include "b.h"\nint x;\n', 2),
+    ('#define TEXT "a" // /* not a comment\n#include "b.h"\nint x;\n', 2),
+    ('int x; /* code */\n#include "b.h"\n', 0),
+])
+def test_leading_directives_of_c_file(lines, kept):
+    expected = ''.join(lines.splitlines(keepends=True)[:kept])
+    assert parse.PreProcessor.read_leading_directives(io.StringIO(lines)) == expected
+
+
+@pytest.mark.parametrize('text, in_comment, is_open', [
+    ('#include "a.h" /* comment', False, True),
+    ('#include "a.h" /* comment */', False, False),
+    ('comment */ /* again', True, True),
+    ('"/*" \'/*\'', False, False),
+    ('// /* comment', False, False),
+    ('still comment', True, True),
+])
+def test_is_comment_open(text, in_comment, is_open):
+    assert parse.is_comment_open(text, in_comment) == is_open
+
+
+def test_include_list_of_cleaned_source():
+    source = parse.PreProcessor._Source(parse.rm_miscellenous('#include "a.h" /* "b.h"\n#include "c.h" */\n#include <d.h>\n'))
+    assert source.include_list == ['a.h', 'd.h']
@@ -0,0 +1,79 @@
+import os
+import json
+import ctypes
+import runpy
+import pytest
+
+header = '''
+typedef enum {
+    MODE_A = 0,
+    MODE_B = 1
+} MODE;
+
+typedef struct {
+    char tag;
+    MODE mode;
+    short count;
+    MODE modes[3];
+    double value;
+} DEV;
+
+typedef union {
+    MODE mode;
+    char bytes[6];
+} DEV_UNION;
+
+#define DEV_SIZE sizeof(DEV)
+#define MODE_SIZE sizeof(MODE)
+'''
+
+
+@pytest.fixture
+def output(parser):
+    os.mkdir('prj')
+    with open(os.path.join('prj', 'dev.h'), 'w') as fp:
+        fp.write(header)
+    with open('config.json', 'r') as fp:
+        config = json.load(fp)
+    config.update(project_folders=['prj'], numpy_dtypes=True)
+    with open('config.json', 'w') as fp:
+        json.dump(config, fp)
+    parser.env = config
+    parser()
+    return os.path.join(os.getcwd(), 'output')
+
+
+def test_enum_member_is_int(output):
+    class_dict = runpy.run_path(os.path.join(output, 'structure_class.py'))
+    fields = dict(class_dict['DEV']._fields_)
+    assert fields['mode'] is ctypes.c_int
+    assert fields['modes'] == ctypes.c_int * 3
+
+
+@pytest.mark.parametrize('struct_name', ['DEV', 'DEV_UNION'])
+def test_layout_matches_ctypes(output, struct_name):
+    class_dict = runpy.run_path(os.path.join(output, 'structure_class.py'))
+    layout_dict = runpy.run_path(os.path.join(output, 'struct_layout.py'))
+    struct_class = class_dict[struct_name]
+    assert layout_dict['SIZEOF'][struct_name] == ctypes.sizeof(struct_class)
+    assert layout_dict['ALIGNOF'][struct_name] == ctypes.alignment(struct_class)
+    for member, offset in layout_dict['OFFSETOF'][struct_name].items():
+        assert offset == getattr(struct_class, member).offset
+
+
+@pytest.mark.parametrize('struct_name', ['DEV', 'DEV_UNION'])
+def test_numpy_dtype_matches_ctypes(output, struct_name):
+    pytest.importorskip('numpy')
+    class_dict = runpy.run_path(os.path.join(output, 'structure_class.py'))
+    dtype = runpy.run_path(os.path.join(output, 'numpy_dtypes.py'))[struct_name]
+    struct_class = class_dict[struct_name]
+    assert dtype.itemsize == ctypes.sizeof(struct_class)
+    for member, _ in struct_class._fields_:
+        assert dtype.fields[member][1] == getattr(struct_class, member).offset
+        assert dtype.fields[member][0].itemsize == getattr(struct_class, member).size
+
+
+def test_sizeof_in_macros(parser, output):
+    class_dict = runpy.run_path(os.path.join(output, 'structure_class.py'))
+    assert parser.eval_c_expr('DEV_SIZE') == ctypes.sizeof(class_dict['DEV'])
+    assert parser.eval_c_expr('MODE_SIZE') == ctypes.sizeof(ctypes.c_int)
@@ -0,0 +1,132 @@
+"""
+    @usage: watch the header files and C files set in config.json, convert them again once any of them is changed
+    @date: 2026-10-16
+    @python: 3.7
+    @version: 2.1.17
+"""
+import os
+import copy
+import time
+import hashlib
+import logging
+import traceback
+from parse import Parser
+
+
+class Watcher:
+    """
+    Poll the files to convert with os.stat and convert them again once they are changed.
+    Only the standard library is used, so it runs on any platform without inotify.
+    The cleaned sources and the cache of the last run are kept in memory, so that unchanged files are neither read nor
+    preprocessed again. The other stages of the conversion are run in full each time.
+    """
+    def __init__(self):
+        self.file_state_dict = dict()       # key = file path, value = (mtime, size, hash of content)
+        self.source_dict = dict()           # cleaned sources of the last run
+        self.cache_dict = None              # cache of the last run, None before the first run
+        self.output_hash_dict = dict()      # key = output file, value = hash of content
+        self.parser = None                  # parser of the current config.json, a copy of it converts the files
+        self.config_mtime = None            # mtime of config.json when the parser was built
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        with open(file_path, 'rb') as fp:
+            return hashlib.sha1(fp.read()).hexdigest()
+
+    def poll(self, files: list) -> list:
+        """
+        Return the files that are added, removed or changed since the last poll.
+        A file is only hashed when its mtime or size changes, and it is not regarded as changed if only touched.
+        """
+        changed_files = list()
+        file_state_dict = dict()
+        for file in files:
+            try:
+                stat = os.stat(file)
+                state = self.file_state_dict.get(file)
+                if state is None or state[:2] != (stat.st_mtime_ns, stat.st_size):
+                    state = (stat.st_mtime_ns, stat.st_size, self.hash_file(file))
+                    if self.file_state_dict.get(file, (None, None, None))[2] != state[2]:
+                        changed_files.append(file)
+            except OSError:
+                continue                    # removed while polling, it will be found in next poll
+            file_state_dict[file] = state
+        changed_files.extend(file for file in self.file_state_dict if file not in file_state_dict)
+        self.file_state_dict = file_state_dict
+        return changed_files
+
+    def get_parser(self) -> tuple:
+        """
+        Return the parser of config.json and whether config.json is changed since the last call.
+        The parser is only built again once config.json is changed.
+        """
+        config_mtime = os.stat('config.json').st_mtime_ns
+        if self.parser is not None and config_mtime == self.config_mtime:
+            return self.parser, False
+        is_config_changed = self.parser is not None
+        self.parser = Parser()
+        self.config_mtime = config_mtime
+        return self.parser, is_config_changed
+
+    def convert(self, parser: Parser, changed_files: list):
+        """
+        Convert the files with the sources and cache of the last run.
+        A copy of the parser is used, since the tables filled in a conversion must be empty before the next one.
+        """
+        parser = copy.deepcopy(parser)
+        parser.source_dict = {file: source for file, source in self.source_dict.items() if file not in changed_files}
+        parser.cache_dict = self.cache_dict
+        parser.convert()
+        self.source_dict = parser.source_dict
+        self.cache_dict = parser.new_cache_dict
+
+    def get_updated_outputs(self) -> list:
+        """
+        Return the files in the output tree which are added or changed since the last call, e.g. the submodules of
+        per_header_package and the data of binary arrays. The bytecode and the cache are skipped.
+        """
+        updated_outputs = list()
+        output_hash_dict = dict()
+        for root, dirs, files in os.walk('output'):
+            dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                if file_path == os.path.join('output', 'parse_cache.json'):
+                    continue
+                file = os.path.relpath(file_path, 'output')
+                output_hash_dict[file] = self.hash_file(file_path)
+                if self.output_hash_dict.get(file) != output_hash_dict[file]:
+                    updated_outputs.append(file)
+        self.output_hash_dict = output_hash_dict
+        return updated_outputs
+
+    def run(self):
+        print('Watching the files in config.json, press Ctrl+C to stop.')
+        while True:
+            parser, is_config_changed = self.get_parser()
+            parser.collect_files()
+            changed_files = self.poll(parser.h_files + parser.c_files)
+            if changed_files or is_config_changed:
+                if changed_files:
+                    print(f'{len(changed_files)} file(s) changed, converting...')
+                else:
+                    print('config.json changed, converting...')
+                start_time = time.time()
+                try:
+                    self.convert(parser, changed_files)
+                except Exception:
+                    logging.error(traceback.format_exc())
+                    print('Failed to convert, please check debug.log.')
+                    self.source_dict = dict()
+                    self.cache_dict = None
+                else:
+                    updated_outputs = self.get_updated_outputs()
+                    print(f'Converted in {time.time() - start_time:.2f}s, updated: {", ".join(updated_outputs) or "none"}')
+            time.sleep(parser.env.get('watch_interval', 1.0))
+
+
+if __name__ == '__main__':
+    try:
+        Watcher().run()
+    except KeyboardInterrupt:
+        pass